@@ -0,0 +1,100 @@
+"""
+Association metrics between mutually exclusive groups and binary outcomes.
+
+For the Substance Use view the groups are the substance-use disorders (each
+client has at most one) and the outcomes are the 13 diagnosis flags. Every
+(group, outcome) pair defines a 2x2 table
+
+                 outcome    no outcome
+    group           a           b          (a + b = group total)
+    other groups    c           d          (a + c = outcome total)
+
+and all the tables are evaluated at once as NumPy arrays, so a filter
+selection costs a handful of array operations rather than a loop over pairs.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Two-sided 95% normal quantile.
+Z_95 = 1.959963984540054
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+
+
+def association_metrics(counts: np.ndarray, group_totals: np.ndarray, z: float = Z_95) -> Dict[str, np.ndarray]:
+    """
+    `counts[g, o]` is the number of members of group g with outcome o and
+    `group_totals[g]` the size of group g. Returns arrays shaped like `counts`:
+
+    count, conditional (P(outcome | group)) with its Wilson interval
+    (conditional_low/high), lift (P(outcome | group) / P(outcome)), odds_ratio
+    with its Woolf interval (odds_ratio_low/high; 0.5 is added to every cell of
+    tables with a zero), and the 1-df Pearson chi_square with its p_value.
+    """
+    a = np.asarray(counts, dtype=np.float64)
+    group = np.asarray(group_totals, dtype=np.float64)[:, None]
+    outcome = a.sum(axis=0, keepdims=True)
+    n = group.sum()
+
+    b = group - a
+    c = outcome - a
+    d = n - group - outcome + a
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        conditional = np.where(group > 0, a / group, np.nan)
+        centre = (a + z**2 / 2) / (group + z**2)
+        half = z * np.sqrt(a * b / group + z**2 / 4) / (group + z**2)
+        lift = conditional / (outcome / n)
+
+        zero = (a == 0) | (b == 0) | (c == 0) | (d == 0)
+        ac, bc, cc, dc = (np.where(zero, cell + 0.5, cell) for cell in (a, b, c, d))
+        log_or = np.log(ac * dc / (bc * cc))
+        se = np.sqrt(1 / ac + 1 / bc + 1 / cc + 1 / dc)
+
+        margins = group * (n - group) * outcome * (n - outcome)
+        chi_square = np.where(margins > 0, n * (a * d - b * c) ** 2 / margins, 0.0)
+
+    p_value = _erfc(np.sqrt(chi_square / 2)).astype(np.float64)
+    return {
+        "count": a,
+        "conditional": conditional,
+        "conditional_low": np.clip(centre - half, 0, 1),
+        "conditional_high": np.clip(centre + half, 0, 1),
+        "lift": lift,
+        "odds_ratio": np.exp(log_or),
+        "odds_ratio_low": np.exp(log_or - z * se),
+        "odds_ratio_high": np.exp(log_or + z * se),
+        "chi_square": chi_square,
+        "p_value": p_value,
+    }
+
+
+def association_frame(
+    metrics: Dict[str, np.ndarray],
+    groups: Sequence,
+    outcomes: Sequence,
+    group_col: str,
+    outcome_col: str,
+    keep: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """
+    Long frame with one row per (group, outcome) pair and one column per
+    metric, limited to the pairs where the boolean array `keep` (shaped like
+    the metrics) is set. The pairs are selected on the arrays, so the frame
+    is built once at its final size.
+    """
+    shape = (len(groups), len(outcomes))
+    group_idx, outcome_idx = np.nonzero(np.ones(shape, dtype=bool) if keep is None else keep)
+    columns = {
+        group_col: np.asarray(groups, dtype=object)[group_idx],
+        outcome_col: np.asarray(outcomes, dtype=object)[outcome_idx],
+    }
+    for name, values in metrics.items():
+        columns[name] = np.broadcast_to(values, shape)[group_idx, outcome_idx]
+    return pd.DataFrame(columns)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of precompute_stats.preprocess against the original
+row-wise implementation.
+
+Usage:
+    python bench_preprocess.py --source MHCLD_PUF_2023_clean.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from precompute_stats import USECOLS, preprocess
+
+
+def preprocess_rowwise(chunk: pd.DataFrame) -> pd.DataFrame:
+    """The original preprocess(): full copy, per-row lambda and a bool map."""
+    chunk = chunk.copy()
+    chunk["SUB_dia"] = chunk["SUB"].notna().map({True: "YES", False: "NO"})
+    chunk["SAP"] = chunk["SAP"].apply(
+        lambda val: "missing" if pd.isna(val) else str(val)
+    )
+    chunk["CLIENT_COUNT"] = 1
+    return chunk
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark preprocess().")
+    parser.add_argument(
+        "--source",
+        required=True,
+        type=Path,
+        help="Path to the MHCLD_PUF_2023_clean.csv file.",
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=250_000,
+        help="Number of rows in the benchmarked chunk (default: one default chunk).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of timed runs per implementation; the best run is reported.",
+    )
+    return parser.parse_args()
+
+
+def best_time(func, chunk: pd.DataFrame, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        # preprocess() works in place, so every run gets its own input.
+        data = chunk.copy()
+        started = time.perf_counter()
+        func(data)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    args = parse_args()
+    chunk = pd.read_csv(args.source, nrows=args.rows, usecols=USECOLS, low_memory=False)
+
+    expected = preprocess_rowwise(chunk)
+    actual = preprocess(chunk.copy())
+    for col in ["SUB_dia", "SAP", "CLIENT_COUNT"]:
+        if not expected[col].astype(str).equals(actual[col].astype(str)):
+            raise SystemExit(f"preprocess() output differs from the row-wise version in {col}")
+
+    rowwise = best_time(preprocess_rowwise, chunk, args.repeat)
+    vectorized = best_time(preprocess, chunk, args.repeat)
+    print(f"rows:       {len(chunk):,}")
+    print(f"row-wise:   {rowwise * 1000:8.1f} ms")
+    print(f"vectorized: {vectorized * 1000:8.1f} ms")
+    print(f"speedup:    {rowwise / vectorized:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Clean the raw MHCLD public use file in a single streaming pass.
+
+The raw PUF stores every field as an integer code (-9 for missing). Each chunk
+is recoded with vectorized lookups on those codes, so the whole file never has
+to fit in memory. The cleaned chunks can be written to CSV, or handed straight
+to precompute_stats.py (see its --raw flag) without an intermediate file.
+An output ending in .parquet is written as record-level Parquet (one row group
+per chunk), which the dashboard's DuckDB backend queries directly.
+
+An output without a suffix is written as a hive-partitioned Parquet dataset,
+one directory per state (STATEFIP_code=6/) and per year when the source has
+a YEAR column (YEAR=2023/STATEFIP_code=6/). Label columns are stored as their
+integer category codes and _dictionary.json maps the codes back to labels,
+so a reader interested in a few states opens only their files.
+
+Usage:
+    python clean_data.py --source MHCLD_PUF_2023.csv --output MHCLD_PUF_2023_clean.csv
+    python clean_data.py --source MHCLD_PUF_2023.csv --output data/MHCLD_PUF_2023_clean.parquet
+    python clean_data.py --source MHCLD_PUF_2023.csv --output data/MHCLD_PUF_2023_clean
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+RAW_COLUMNS: List[str] = [
+    "AGE", "SEX", "RACE", "LIVARAG", "EMPLOY",
+    "SUB", "SAP", "ALCSUBFLG",
+    "TRAUSTREFLG", "ANXIETYFLG", "ADHDFLG", "CONDUCTFLG",
+    "DELIRDEMFLG", "BIPOLARFLG", "DEPRESSFLG", "ODDFLG",
+    "PDDFLG", "PERSONFLG", "SCHIZOFLG", "OTHERDISFLG",
+    "SPHSERVICE", "CMPSERVICE", "OPISERVICE", "RTCSERVICE", "IJSSERVICE",
+    "STATEFIP",
+]
+
+SERVICE_COLS: List[str] = [
+    "SPHSERVICE",
+    "CMPSERVICE",
+    "OPISERVICE",
+    "RTCSERVICE",
+    "IJSSERVICE",
+]
+
+MISSING_CODE = -9
+
+# Kept (as an integer) in Parquet output only; the partitioned dataset is
+# partitioned by it.
+YEAR_COL = "YEAR"
+
+# Partition columns of the partitioned dataset, outermost first; YEAR only
+# when the source has it.
+PARTITION_COLS: List[str] = [YEAR_COL, "STATEFIP_code"]
+
+DICTIONARY_FILE = "_dictionary.json"
+# Rows buffered per partition before a row group is written.
+PARTITION_ROW_GROUP = 100_000
+
+AGE_BAND_MAP: Dict[int, str] = {
+    1: "Under 15",
+    2: "Under 15",
+    3: "15-24",
+    4: "15-24",
+    5: "15-24",
+    6: "25-34",
+    7: "25-34",
+    8: "35-44",
+    9: "35-44",
+    10: "45-54",
+    11: "45-54",
+    12: "55-64",
+    13: "65 and older",
+    14: "65 and older",
+}
+
+SEX_MAP: Dict[int, str] = {
+    1: "Male",
+    2: "Female",
+}
+
+RACE_MAP: Dict[int, str] = {
+    1: "American Indian/Alaska Native",
+    2: "Asian",
+    3: "Black or African American",
+    4: "Native Hawaiian or Other Pacific Islander",
+    5: "White",
+    6: "Some other race alone/two or more races",
+}
+
+LIVARAG_MAP: Dict[int, str] = {
+    1: "Experiencing Homelessness",
+    2: "Private residence",
+    3: "Other",
+}
+
+EMPLOY_MAP: Dict[int, str] = {
+    1: "Full-time",
+    2: "Part-time",
+    3: "Employed FT/PT not differentiated",
+    4: "Unemployed",
+    5: "Not in labor force",
+}
+
+SUB_MAP: Dict[int, str] = {
+    1: "Alcohol-induced disorder",
+    2: "Alcohol intoxication",
+    3: "Substance-induced disorder",
+    4: "Alcohol dependence",
+    5: "Cocaine dependence",
+    6: "Cannabis dependence",
+    7: "Opioid dependence",
+    8: "Other substance dependence",
+    9: "Alcohol abuse",
+    10: "Cocaine abuse",
+    11: "Cannabis abuse",
+    12: "Opioid abuse",
+    13: "Other substance related conditions",
+}
+
+STATE_MAP: Dict[int, str] = {
+    1: "Alabama",
+    2: "Alaska",
+    4: "Arizona",
+    5: "Arkansas",
+    6: "California",
+    8: "Colorado",
+    9: "Connecticut",
+    10: "Delaware",
+    11: "District of Columbia",
+    12: "Florida",
+    13: "Georgia",
+    15: "Hawaii",
+    16: "Idaho",
+    17: "Illinois",
+    18: "Indiana",
+    19: "Iowa",
+    20: "Kansas",
+    21: "Kentucky",
+    22: "Louisiana",
+    24: "Maryland",
+    25: "Massachusetts",
+    26: "Michigan",
+    27: "Minnesota",
+    28: "Mississippi",
+    29: "Missouri",
+    30: "Montana",
+    31: "Nebraska",
+    32: "Nevada",
+    33: "New Hampshire",
+    34: "New Jersey",
+    35: "New Mexico",
+    36: "New York",
+    37: "North Carolina",
+    38: "North Dakota",
+    39: "Ohio",
+    40: "Oklahoma",
+    41: "Oregon",
+    42: "Pennsylvania",
+    44: "Rhode Island",
+    45: "South Carolina",
+    46: "South Dakota",
+    47: "Tennessee",
+    48: "Texas",
+    49: "Utah",
+    50: "Vermont",
+    51: "Virginia",
+    53: "Washington",
+    54: "West Virginia",
+    55: "Wisconsin",
+    56: "Wyoming",
+    72: "Puerto Rico",
+    99: "Other jurisdictions",
+}
+
+LABEL_MAPS: Dict[str, Dict[int, str]] = {
+    "AGE": AGE_BAND_MAP,
+    "SEX": SEX_MAP,
+    "RACE": RACE_MAP,
+    "LIVARAG": LIVARAG_MAP,
+    "EMPLOY": EMPLOY_MAP,
+    "SUB": SUB_MAP,
+    "STATEFIP": STATE_MAP,
+}
+
+
+class Recoder:
+    """
+    Vectorized integer-code -> label lookup.
+
+    The labels become the categories of a pandas Categorical, in sorted order,
+    and a lookup table maps every raw code straight to its category code.
+    Unmapped codes (including -9) become missing values.
+    """
+
+    def __init__(self, mapping: Dict[int, str]):
+        self.categories = sorted(set(mapping.values()))
+        self.table = np.full(max(mapping) + 1, -1, dtype=np.int16)
+        for code, label in mapping.items():
+            self.table[code] = self.categories.index(label)
+
+    def __call__(self, codes: np.ndarray) -> pd.Categorical:
+        valid = (codes >= 0) & (codes < len(self.table))
+        category_codes = np.full(len(codes), -1, dtype=np.int16)
+        category_codes[valid] = self.table[codes[valid]]
+        return pd.Categorical.from_codes(category_codes, categories=self.categories)
+
+
+RECODERS: Dict[str, Recoder] = {col: Recoder(mapping) for col, mapping in LABEL_MAPS.items()}
+
+
+def raw_codes(column: pd.Series) -> np.ndarray:
+    """Integer codes of a raw column, with blanks treated as missing (-9)."""
+    if column.dtype.kind in "iu":
+        return column.to_numpy(dtype=np.int64)
+    return column.fillna(MISSING_CODE).to_numpy(dtype=np.int64)
+
+
+def recode_binary(codes: np.ndarray, yes: int, no: int) -> np.ndarray:
+    """Map a yes/no coded column to 1.0/0.0, with anything else missing."""
+    values = np.full(len(codes), np.nan)
+    values[codes == yes] = 1.0
+    values[codes == no] = 0.0
+    return values
+
+
+def recode_flag(codes: np.ndarray) -> pd.arrays.IntegerArray:
+    """Keep 0/1 codes as a nullable Int8 array, with -9 as missing."""
+    missing = codes == MISSING_CODE
+    return pd.arrays.IntegerArray(np.where(missing, 0, codes).astype(np.int8), missing)
+
+
+def recode_state(codes: np.ndarray) -> pd.arrays.IntegerArray:
+    """Numeric state codes as a nullable Int64 array, with -9 (unknown state) as missing."""
+    missing = codes == MISSING_CODE
+    return pd.arrays.IntegerArray(np.where(missing, 0, codes), missing)
+
+
+def clean_chunk(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the MHCLD recodes to one chunk of the raw PUF.
+    Mirrors the original data_clean.ipynb: demographic, substance and state
+    codes become labels, -9 becomes missing, services and SAP are recoded
+    from 1/2 (yes/no) to 1/0, and the numeric state code is kept as
+    STATEFIP_code (missing, like STATEFIP, for -9).
+    """
+    cleaned = {}
+    for col in raw.columns:
+        codes = raw_codes(raw[col])
+        if col in RECODERS:
+            cleaned[col] = RECODERS[col](codes)
+        elif col == YEAR_COL:
+            cleaned[col] = codes.astype(np.int16)
+        elif col == "SAP":
+            cleaned[col] = recode_binary(codes, yes=1, no=2)
+        elif col in SERVICE_COLS:
+            cleaned[col] = recode_flag(np.where(codes == 2, 0, codes))
+        else:
+            cleaned[col] = recode_flag(codes)
+    cleaned["STATEFIP_code"] = recode_state(raw_codes(raw["STATEFIP"]))
+    return pd.DataFrame(cleaned, index=raw.index)
+
+
+def iter_clean_chunks(source, chunk_size: int, keep_year: bool = False, **read_kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Stream cleaned chunks from a raw PUF path or open text stream. With
+    `keep_year`, the YEAR column is kept if the source has one.
+    """
+    if keep_year:
+        read_kwargs.setdefault("usecols", lambda col: col in RAW_COLUMNS or col == YEAR_COL)
+    read_kwargs.setdefault("usecols", RAW_COLUMNS)
+    for raw in pd.read_csv(source, chunksize=chunk_size, low_memory=False, **read_kwargs):
+        yield clean_chunk(raw)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Clean the raw MHCLD PUF.")
+    parser.add_argument(
+        "--source",
+        required=True,
+        type=Path,
+        help="Path to the raw MHCLD_PUF_2023.csv file.",
+    )
+    parser.add_argument(
+        "--output",
+        required=True,
+        type=Path,
+        help=(
+            "Path of the cleaned data to write: CSV, Parquet if it ends in .parquet, "
+            "or a partitioned Parquet directory if it has no suffix."
+        ),
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=250_000,
+        help="Number of rows to process per chunk when streaming the source CSV.",
+    )
+    return parser.parse_args()
+
+
+def write_csv(chunks: Iterator[pd.DataFrame], output: Path) -> int:
+    rows = 0
+    with open(output, "w", newline="") as handle:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(handle, index=False, header=i == 0)
+            rows += len(chunk)
+    return rows
+
+
+def write_parquet(chunks: Iterator[pd.DataFrame], output: Path) -> int:
+    """
+    Stream chunks into one Parquet file. Labels are dictionary-encoded (the
+    recoders give every chunk the same categories, so the schema is stable)
+    and each chunk becomes a row group with its own min/max statistics.
+    """
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def encode_chunk(chunk: pd.DataFrame) -> pa.Table:
+    """Arrow table of a cleaned chunk with every label column replaced by its category codes."""
+    columns = {}
+    for col in chunk.columns:
+        if col in RECODERS:
+            codes = chunk[col].cat.codes.to_numpy()
+            columns[col] = pa.array(codes.astype(np.int8), mask=codes < 0)
+        else:
+            columns[col] = pa.Array.from_pandas(chunk[col])
+    return pa.table(columns)
+
+
+def write_partitioned(chunks: Iterator[pd.DataFrame], output: Path) -> int:
+    """
+    Stream chunks into a hive-partitioned Parquet dataset under `output`,
+    replacing any files of the partitions written, and save the label
+    dictionary next to it.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return 0
+    partitioning = [col for col in PARTITION_COLS if col in first.columns]
+    schema = encode_chunk(first).schema
+    rows = 0
+
+    def batches() -> Iterator[pa.RecordBatch]:
+        nonlocal rows
+        for chunk in itertools.chain([first], chunks):
+            rows += len(chunk)
+            yield from encode_chunk(chunk).to_batches()
+
+    ds.write_dataset(
+        batches(),
+        output,
+        schema=schema,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([schema.field(col) for col in partitioning]), flavor="hive"),
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+        min_rows_per_group=PARTITION_ROW_GROUP,
+    )
+    dictionary = {
+        "partitioning": partitioning,
+        "columns": {col: RECODERS[col].categories for col in schema.names if col in RECODERS},
+    }
+    (output / DICTIONARY_FILE).write_text(json.dumps(dictionary, indent=1))
+    return rows
+
+
+def read_dictionary(path: Path) -> dict:
+    """The label dictionary of a partitioned dataset written by write_partitioned."""
+    return json.loads((Path(path) / DICTIONARY_FILE).read_text())
+
+
+def decode_table(table: pa.Table, categories: Dict[str, List[str]]) -> pd.DataFrame:
+    """Frame of a partitioned-dataset table with the coded columns turned back into labels."""
+    frame = table.to_pandas()
+    for col, labels in categories.items():
+        if col in frame.columns:
+            codes = frame[col].fillna(-1).to_numpy(dtype=np.int16)
+            frame[col] = pd.Categorical.from_codes(codes, categories=labels)
+    return frame
+
+
+def iter_partitioned_chunks(
+    path: Path,
+    chunk_size: int,
+    columns: Optional[Sequence[str]] = None,
+    row_filter: Optional[ds.Expression] = None,
+    files: Optional[Sequence[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream cleaned chunks (with labels, as clean_chunk produces them) from a
+    partitioned dataset. `row_filter` is a pyarrow expression; conditions on
+    partition columns skip whole files. `files` restricts the read to some of
+    the dataset's files.
+    """
+    dictionary = read_dictionary(path)
+    if files is None:
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    else:
+        dataset = ds.dataset(list(files), format="parquet", partitioning="hive", partition_base_dir=str(path))
+    if columns is not None:
+        columns = [col for col in columns if col in dataset.schema.names]
+    for batch in dataset.to_batches(columns=columns, filter=row_filter, batch_size=chunk_size):
+        if batch.num_rows:
+            yield decode_table(pa.Table.from_batches([batch]), dictionary["columns"])
+
+
+def dataset_files(path: Path) -> List[str]:
+    """Data files of a partitioned dataset, in a stable order."""
+    return sorted(ds.dataset(path, format="parquet", partitioning="hive").files)
+
+
+def dataset_years(path: Path) -> List[int]:
+    """Distinct YEAR values of a partitioned dataset; empty if it has no YEAR column."""
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    if YEAR_COL not in dataset.schema.names:
+        return []
+    years = dataset.to_table(columns=[YEAR_COL]).column(YEAR_COL).to_pandas()
+    return sorted(int(year) for year in years.dropna().unique())
+
+
+def main() -> None:
+    args = parse_args()
+    if not args.output.suffix:
+        rows = write_partitioned(iter_clean_chunks(args.source, args.chunk_size, keep_year=True), args.output)
+    elif args.output.suffix == ".parquet":
+        rows = write_parquet(iter_clean_chunks(args.source, args.chunk_size, keep_year=True), args.output)
+    else:
+        rows = write_csv(iter_clean_chunks(args.source, args.chunk_size), args.output)
+    print(f"Saved {rows:,} cleaned rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
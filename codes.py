@@ -1,9 +1,25 @@
+import json
+import os
+
 import altair as alt
 import pandas as pd
 import streamlit as st
 from pathlib import Path
 from typing import Optional
-from vega_datasets import data
+
+from association import association_frame, association_metrics
+from comorbidity import ComorbidityCube
+from data_cube import DataCube
+from filter_index import FILTER_DIMENSIONS, FilterIndex
+from query_backend import DuckDBBackend, PandasBackend, QueryBackend
+from result_cache import LRUCache
+from shared_dataset import SharedDataset
+
+if int(pd.__version__.split(".")[0]) < 3:
+    # Copy-on-Write is always on from pandas 3. Earlier versions opt in so
+    # every session shares the aggregate frames without copying them
+    # (see shared_dataset.py).
+    pd.set_option("mode.copy_on_write", True)
 
 BASE_PATH = Path(__file__).resolve().parent
 AGE_BIN_LABELS = ["Under 15", "15-24", "25-34", "35-44", "45-54", "55-64", "65 and older"]
@@ -23,6 +39,7 @@ DIAGNOSIS_COLS = [
     "OTHERDISFLG",
 ]
 SERVICE_COLS = ["SPHSERVICE", "CMPSERVICE", "OPISERVICE", "RTCSERVICE", "IJSSERVICE"]
+MEASURE_COLS = DIAGNOSIS_COLS + SERVICE_COLS + ["CLIENT_COUNT"]
 FLAG_TO_NAME = {
     "TRAUSTREFLG": "Trauma & Stressor Disorder",
     "ANXIETYFLG": "Anxiety Disorder",
@@ -46,9 +63,66 @@ SERVICE_TO_NAME = {
     "IJSSERVICE": "Institutions Under The Justice System",
 }
 TYPE_MAP = FLAG_TO_NAME
+SAP_MAP = {'1.0': 'problem', '0.0': 'no problem', 'missing': 'missing'}
+# Heatmap colour options of the Substance Use view: field and colour scale.
+ASSOCIATION_METRICS = {
+    "Count": ("mh", alt.Scale(type='log', clamp=True), 'log(count)'),
+    "Conditional % (diagnosis given substance)": ("conditional", alt.Scale(scheme='blues'), 'P(diagnosis | substance)'),
+    "Lift": ("lift", alt.Scale(type='log', scheme='redblue', reverse=True, domainMid=1), 'lift'),
+    "Odds ratio": ("odds_ratio", alt.Scale(type='log', scheme='redblue', reverse=True, domainMid=1), 'odds ratio'),
+    "Chi-square": ("chi_square", alt.Scale(type='sqrt', scheme='oranges'), 'chi-square'),
+}
+# Measure columns, long-format column name and display names of each map/bar view.
+VIEW_MEASURES = {
+    "Diagnosed Mental Disorders": (DIAGNOSIS_COLS, "Diagnosis", FLAG_TO_NAME),
+    "Mental Health Service Use": (SERVICE_COLS, "Service", SERVICE_TO_NAME),
+}
+EMPTY_VIEW_MESSAGES = {
+    "Diagnosed Mental Disorders": "No diagnosed disorders found for the selected demographic filters.",
+    "Mental Health Service Use": "No service utilization data matched the selected demographic filters.",
+}
+BAR_DIMENSIONS = ["SEX", "AGE", "RACE", "EMPLOY", "LIVARAG"]
+# Stacked-bar chart per dimension: legend title, legend columns, colour scale
+# and the label used in the chart title.
+BAR_CHARTS = {
+    "SEX": ("Sex", 3, alt.Scale(domain=["Female", "Male", "Missing"], range=["#e78ac3", "#8da0cb", "#e41a1c"]), "Sex"),
+    "AGE": ("Age", 4, alt.Scale(scheme="blues", domain=AGE_BIN_LABELS), "Age"),
+    "RACE": ("Race", 4, alt.Scale(scheme='set3'), "Race"),
+    "EMPLOY": ("Social-Economic Status", 3, alt.Scale(scheme='tableau10'), "Social-Economic Status (EMPLOY)"),
+    "LIVARAG": ("Living Status", 3, alt.Scale(scheme='set2'), "Living Status (LIVARAG)"),
+}
+# Per view: y axis title and style, x axis title, chart title prefix, chart
+# width (None for the default) and whether charts stretch to the container.
+BAR_VIEWS = {
+    "Diagnosed Mental Disorders": (
+        "Disorder Type", alt.Axis(labelLimit=300), "Number of Diagnoses", "Diagnosis", None, True,
+    ),
+    "Mental Health Service Use": (
+        "Service Type", alt.Axis(labelLimit=300, labelPadding=10, titlePadding=80), "Number of Service Uses",
+        "Service Use", 800, False,
+    ),
+}
+# "separate" sends one chart (and dataset) per stacked bar; "shared" sends the
+# five bars as one concatenated chart over a single dataset, which the charts
+# filter by dimension in the browser.
+BAR_MODE = os.environ.get("MHCLD_BAR_MODE", "separate")
+# Default of the sidebar's "Filter in the browser" toggle (see client_filtered_chart).
+CLIENT_FILTERING = os.environ.get("MHCLD_CLIENT_FILTERING", "") == "1"
 
 
 FILTER_COLUMNS = ["RACE", "SEX", "EMPLOY", "LIVARAG"]
+# Axes of the demographic count cube; the state name and FIPS code share one axis.
+CUBE_AXES = {
+    "AGE": ["AGE"],
+    "RACE": ["RACE"],
+    "SEX": ["SEX"],
+    "EMPLOY": ["EMPLOY"],
+    "LIVARAG": ["LIVARAG"],
+    "STATE": ["STATEFIP", "STATEFIP_code"],
+}
+# Year of each record, present in aggregates built from one or more yearly
+# sources; each year is its own filterable slice of every cube.
+YEAR_COL = "YEAR"
 
 
 def horizontal_legend(title: str, columns: Optional[int] = 3) -> alt.Legend:
@@ -66,170 +140,521 @@ def horizontal_legend(title: str, columns: Optional[int] = 3) -> alt.Legend:
     return alt.Legend(**legend_config)
 
 
-@st.cache_data
-def load_aggregated_data():
+# Columnar outputs of `precompute_stats.py --format parquet|arrow` are preferred
+# over the CSV fallback: they load without parsing and keep categorical dtypes.
+AGGREGATE_SUFFIXES = [".parquet", ".arrow", ".csv"]
+
+
+def read_aggregate(name: str, csv_dtype: dict) -> pd.DataFrame:
+    """Read `data/<name>` from the first available file format."""
+    for suffix in AGGREGATE_SUFFIXES:
+        path = BASE_PATH / "data" / f"{name}{suffix}"
+        if not path.exists():
+            continue
+        if suffix == ".parquet":
+            return pd.read_parquet(path)
+        if suffix == ".arrow":
+            return pd.read_feather(path)
+        return pd.read_csv(path, dtype=csv_dtype)
+    raise FileNotFoundError(f"No aggregated data found for '{name}' in {BASE_PATH / 'data'}")
+
+
+def fill_missing(series: pd.Series) -> pd.Series:
+    if isinstance(series.dtype, pd.CategoricalDtype) and "Missing" not in series.cat.categories:
+        series = series.cat.add_categories("Missing")
+    return series.fillna("Missing")
+
+
+def category_order(column: str, values: pd.Series) -> list:
     """
-    Load pre-aggregated datasets produced by precompute_stats.py.
-    Missing demographic values are filled with 'Missing' so the UI can include them.
+    Fixed category order of a dimension column: the order of the dimension
+    dictionary (or AGE_BIN_LABELS for AGE), then any other values sorted.
+    Filter columns with missing values get a 'Missing' category.
     """
-    demo_path = BASE_PATH / "data" / "demographic_service_stats.csv"
-    substance_path = BASE_PATH / "data" / "substance_stats.csv"
-    demographic = pd.read_csv(demo_path, dtype={"STATEFIP_code": str})
-    substance = pd.read_csv(substance_path, dtype={"SAP": str})
+    present = set(values.dropna().unique().tolist())
+    if column in FILTER_COLUMNS and values.isna().any():
+        present.add("Missing")
+    known = [entry["value"] for entry in load_dimensions().get(column, [])]
+    if not known and column == "AGE":
+        known = AGE_BIN_LABELS
+    order = [value for value in known if value in present]
+    return order + sorted(present - set(order))
+
+
+def typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compact dtypes for an aggregate frame: every dimension column becomes a
+    categorical in category_order (missing filter values as 'Missing') and
+    every measure the narrowest integer type that holds its counts.
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if col in MEASURE_COLS:
+            columns[col] = pd.to_numeric(values, downcast="integer")
+            continue
+        values = values.astype(pd.CategoricalDtype(category_order(col, values)))
+        columns[col] = values.fillna("Missing") if col in FILTER_COLUMNS else values
+    return pd.DataFrame(columns)
 
-    for col in FILTER_COLUMNS:
-        demographic[col] = demographic[col].fillna("Missing")
-        substance[col] = substance[col].fillna("Missing")
 
+@st.cache_resource
+def load_aggregated_data() -> SharedDataset:
+    """
+    Load pre-aggregated datasets produced by precompute_stats.py, once per
+    process; every session reads the same read-only frames. They are typed
+    copies (typed_frame) of what was read, held in memory by the process.
+    Missing demographic values are filled with 'Missing' so the UI can include them.
+    """
+    demographic = read_aggregate("demographic_service_stats", {"STATEFIP_code": str})
+    substance = read_aggregate("substance_stats", {"SAP": str})
     if "SUB_dia" not in substance.columns:
         substance["SUB_dia"] = substance["SUB"].notna().map({True: "YES", False: "NO"})
-    return demographic, substance
 
+    frames = {"demographic": demographic, "substance": substance}
+    loaded_bytes = {name: int(df.memory_usage(deep=True).sum()) for name, df in frames.items()}
+    return SharedDataset({name: typed_frame(df) for name, df in frames.items()}, loaded_bytes)
+
+
+# Dimension dictionary written by precompute_stats.py next to the aggregates.
+DIMENSIONS_PATH = BASE_PATH / "data" / "dimensions.json"
+
+
+@st.cache_resource
+def load_dimensions() -> dict:
+    """Ordered distinct values per dimension, or {} for data dirs without the sidecar."""
+    if not DIMENSIONS_PATH.exists():
+        return {}
+    return json.loads(DIMENSIONS_PATH.read_text())["dimensions"]
+
+
+def filter_options(column: str) -> list[str]:
+    """Sidebar options for a demographic filter, read from the dimension dictionary when available."""
+    dimensions = load_dimensions()
+    if column in dimensions:
+        return [entry["value"] for entry in dimensions[column]]
+    return load_aggregated_data().options(column)
+
+
+@st.cache_resource
+def load_demographic_cube() -> DataCube:
+    """Count cube over demographic_service_stats, built once per process."""
+    demographic = load_aggregated_data().frame("demographic")
+    axes = dict(CUBE_AXES)
+    if YEAR_COL in demographic.columns:
+        axes[YEAR_COL] = [YEAR_COL]
+    return DataCube.from_frame(demographic, axes, MEASURE_COLS)
+
+
+@st.cache_resource
+def load_comorbidity_cube() -> Optional[ComorbidityCube]:
+    """Diagnosis co-occurrence cube, or None for data dirs built before comorbidity_stats existed."""
+    try:
+        pairs = read_aggregate("comorbidity_stats", {})
+    except FileNotFoundError:
+        return None
+    for col in FILTER_COLUMNS:
+        pairs[col] = fill_missing(pairs[col])
+    return ComorbidityCube(pairs, DIAGNOSIS_COLS)
+
+
+@st.cache_resource
+def load_substance_filter_index() -> FilterIndex:
+    """Bitmap index over substance_stats rows, built once per process."""
+    substance = load_aggregated_data().frame("substance")
+    dimensions = FILTER_DIMENSIONS + [YEAR_COL] if YEAR_COL in substance.columns else FILTER_DIMENSIONS
+    return FilterIndex(substance, dimensions)
+
+
+# Substance x diagnosis cubes written by precompute_stats.py, by the SUB_dia
+# value of the clients they count.
+SUBSTANCE_CUBES = {"YES": "substance_diagnosis_stats", "NO": "sap_diagnosis_stats"}
+
+
+@st.cache_resource
+def load_substance_cubes() -> dict[str, DataCube]:
+    """
+    Diagnosis counts by demographic cell and SUB (or SAP), as DataCubes keyed
+    by SUB_dia, so the substance views are a slice and sum of an array. Data
+    dirs built before these cubes existed fall back to the filter index.
+    """
+    cubes = {}
+    for dia, name in SUBSTANCE_CUBES.items():
+        try:
+            frame = typed_frame(read_aggregate(name, {"SAP": str}))
+        except FileNotFoundError:
+            continue
+        axes = {col: [col] for col in frame.columns if col not in MEASURE_COLS}
+        cubes[dia] = DataCube.from_frame(frame, axes, DIAGNOSIS_COLS + ["CLIENT_COUNT"])
+    return cubes
+
+
+# Which engine answers the dashboard queries: "pandas" over the pre-aggregated
+# files, or "duckdb" over the cleaned record-level Parquet at MHCLD_RECORDS.
+QUERY_BACKEND = os.environ.get("MHCLD_BACKEND", "pandas")
+RECORDS_PATH = Path(os.environ.get("MHCLD_RECORDS", BASE_PATH / "data" / "MHCLD_PUF_2023_clean.parquet"))
+
+
+@st.cache_resource
+def load_backend() -> QueryBackend:
+    """The configured query backend, shared by every session."""
+    if QUERY_BACKEND == "duckdb":
+        return DuckDBBackend(RECORDS_PATH)
+    if QUERY_BACKEND != "pandas":
+        raise ValueError(f"Unknown MHCLD_BACKEND '{QUERY_BACKEND}' (expected 'pandas' or 'duckdb')")
+    return PandasBackend(
+        load_demographic_cube(),
+        load_aggregated_data().frame("substance"),
+        load_substance_filter_index(),
+        load_substance_cubes(),
+    )
 
-demographic_df, substance_df = load_aggregated_data()
-filter_reference = pd.concat(
-    [
-        demographic_df[["AGE", "RACE", "SEX", "EMPLOY", "LIVARAG"]],
-        substance_df[["AGE", "RACE", "SEX", "EMPLOY", "LIVARAG"]],
-    ],
-    ignore_index=True,
-)
 
+# Simplified state outlines bundled with the app (built by simplify_states.py);
+# geometry ids are the STATEFIP_code strings, so map layers look them up directly.
+# The file is served from static/ (server.enableStaticServing in
+# .streamlit/config.toml), so browsers fetch and cache it once instead of
+# receiving it inline in every map spec.
+STATE_GEOMETRY_URL = "app/static/us_states.topo.json"
 
-def apply_demographic_filters(
-    df: pd.DataFrame,
+
+def load_state_geometry() -> alt.Data:
+    """TopoJSON of the state outlines, by URL."""
+    return alt.Data(url=STATE_GEOMETRY_URL, format=alt.DataFormat(type="topojson", feature="states"))
+
+
+@st.cache_resource
+def state_background() -> alt.Chart:
+    """Grey base layer shared by the count and rate maps of both views."""
+    return alt.Chart(load_state_geometry()).mark_geoshape(
+        fill='lightgray',
+        stroke='white'
+    ).project(
+        type='albersUsa'
+    ).properties(
+        width=320,
+        height=400
+    )
+
+
+def long_counts(wide: pd.DataFrame, id_cols: list[str], value_cols: list[str], var_name: str, names: dict) -> pd.DataFrame:
+    """Reshape a small wide aggregate to (id_cols, var_name, Count) rows with positive counts."""
+    long_df = wide.melt(id_vars=id_cols, value_vars=value_cols, var_name=var_name, value_name="Count")
+    long_df = long_df[long_df["Count"] > 0].reset_index(drop=True)
+    long_df[var_name] = long_df[var_name].map(names)
+    return long_df
+
+
+@st.cache_resource
+def load_result_cache() -> LRUCache:
+    """Process-wide cache of per-view aggregates, shared by every session."""
+    return LRUCache(maxsize=512)
+
+
+def cached(key: tuple, compute):
+    return load_result_cache().get_or_compute(key, compute)
+
+
+class NoData(Exception):
+    """Raised by the view computations when a selection leaves nothing to plot."""
+
+
+def normalize_filters(
     age_range: list[str],
     sex_values: list[str],
     races: list[str],
     employ_status: list[str],
     living_status: list[str],
-) -> pd.DataFrame:
-    subset = df[df["AGE"].isin(age_range)]
-    subset = subset[subset["SEX"].isin(sex_values)]
-    subset = subset[subset["RACE"].isin(races)]
-    subset = subset[subset["EMPLOY"].isin(employ_status)]
-    subset = subset[subset["LIVARAG"].isin(living_status)]
+    years: Optional[list[int]] = None,
+) -> tuple:
+    """
+    Hashable, order-independent form of a sidebar selection, used in cache keys.
+    `years` is None when the aggregates have no year dimension.
+    """
+    selections = [age_range, sex_values, races, employ_status, living_status]
+    filters = tuple(
+        (dim, tuple(sorted(values))) for dim, values in zip(FILTER_DIMENSIONS, selections)
+    )
+    if years is not None:
+        filters += ((YEAR_COL, tuple(sorted(years))),)
+    return filters
+
+
+def demographic_view(filters: tuple, view_type: str) -> dict:
+    """State-level and per-dimension aggregates behind the map and stacked bars."""
+    measure_cols, var_name, names = VIEW_MEASURES[view_type]
+    groupings = [[], ["STATEFIP", "STATEFIP_code"]] + [[dim] for dim in BAR_DIMENSIONS]
+    totals, state_counts, *bars = load_backend().demographic_counts(
+        dict(filters), groupings, measure_cols + ["CLIENT_COUNT"]
+    )
+    if totals["CLIENT_COUNT"].sum() == 0:
+        raise NoData(EMPTY_VIEW_MESSAGES[view_type])
+
+    return {
+        "state_totals": state_counts[["STATEFIP", "STATEFIP_code", "CLIENT_COUNT"]].rename(
+            columns={"CLIENT_COUNT": "TotalClients"}
+        ),
+        "state_long": long_counts(state_counts, ["STATEFIP", "STATEFIP_code"], measure_cols, var_name, names),
+        "bars": {
+            dim: long_counts(counts, [dim], measure_cols, var_name, names)
+            for dim, counts in zip(BAR_DIMENSIONS, bars)
+        },
+    }
+
+
+def comorbidity_view(filters: tuple) -> pd.DataFrame:
+    """Long (row, column, clients) form of the co-occurrence matrix for the heatmap."""
+    matrix = load_comorbidity_cube().matrix(dict(filters))
+    matrix = matrix.rename(index=FLAG_TO_NAME, columns=FLAG_TO_NAME)
+    long_df = matrix.rename_axis("Diagnosis").reset_index().melt(
+        id_vars="Diagnosis", var_name="Co-occurring diagnosis", value_name="Clients"
+    )
+    return long_df[long_df["Clients"] > 0].reset_index(drop=True)
+
+
+def map_view(filters: tuple, view_type: str, selected: str) -> pd.DataFrame:
+    """Per-state count and rate of the selected diagnosis or service."""
+    _, var_name, _ = VIEW_MEASURES[view_type]
+    view = cached(("view", filters, view_type), lambda: demographic_view(filters, view_type))
+    state_long = view["state_long"]
+    agg_map = state_long[state_long[var_name] == selected].reset_index(drop=True)
+    agg_map['STATEFIP_code'] = agg_map['STATEFIP_code'].astype(str)
+    map_data = agg_map.merge(view["state_totals"], on=["STATEFIP", "STATEFIP_code"], how="left")
+    map_data["RatePercent"] = (
+        map_data["Count"] / map_data["TotalClients"].replace({0: pd.NA})
+    ).fillna(0) * 100
+    return map_data
+
+
+def substance_sums(filters: tuple, dia: str, by: list[str], measures: list[str]) -> pd.DataFrame:
+    sums = load_backend().substance_counts(dict(filters), dia, by, measures)
+    if sums.empty:
+        raise NoData("No records matched the selected demographic filters for this substance-use view.")
+    return sums
+
+
+def substance_heatmap_view(filters: tuple) -> pd.DataFrame:
+    """
+    Diagnosis counts per substance-use disorder, with each substance's share
+    per diagnosis and the association metrics of every substance x diagnosis
+    pair (see association.py).
+    """
+    sums = substance_sums(filters, "YES", ["SUB"], DIAGNOSIS_COLS + ["CLIENT_COUNT"])
+    counts = sums[DIAGNOSIS_COLS].to_numpy()
+    metrics = association_metrics(counts, sums["CLIENT_COUNT"].to_numpy())
+    # Each substance's share of every diagnosis, out of its diagnosis total.
+    pop = counts.sum(axis=1, keepdims=True)
+    metrics.update(pop=pop, percentage=counts / pop.clip(min=1))
+    metrics["count"] = counts
+    subset = association_frame(metrics, sums["SUB"], DIAGNOSIS_COLS, "SUB", "types_reported", keep=counts > 0)
+    if subset.empty:
+        raise NoData("No diagnosis counts available for the selected substance-use category.")
+    subset = subset.sort_values(["SUB", "types_reported"], kind="stable", ignore_index=True)
+    subset = subset.rename(columns={"count": "mh"})
+    subset["types_reported"] = subset["types_reported"].map(TYPE_MAP).fillna(subset["types_reported"])
     return subset
 
-# create two tabs (merged tab 1 and 3)
-#tab1, tab2 = st.tabs(["Diagnosed Mental Disorders & Mental Health Service", "Substance Use"])
 
-# content for merged tab1
-#with tab1:
-st.header(" Mental Health Client-Level Data (MH-CLD) Visualizer ")
+def sap_view(filters: tuple) -> pd.DataFrame:
+    """Diagnosis counts per substance use problem (SAP) group, for clients without a SUB diagnosis."""
+    sums = substance_sums(filters, "NO", ["SAP"], DIAGNOSIS_COLS)
+    counts = sums[DIAGNOSIS_COLS].to_numpy()
+    subset = association_frame({"mh": counts}, sums["SAP"], DIAGNOSIS_COLS, "SAP", "types_reported", keep=counts > 0)
+    subset = subset.sort_values(["types_reported", "SAP"], kind="stable", ignore_index=True)
+    if subset.empty:
+        raise NoData("No counts available for the selected filters and SAP grouping.")
+    subset['SAP'] = subset['SAP'].fillna('missing').astype(str)
+    subset['SAP'] = subset['SAP'].map(SAP_MAP).fillna(subset['SAP'])
+    subset['types_reported'] = subset['types_reported'].map(TYPE_MAP).fillna(subset['types_reported'])
+    return subset
 
-# Add radio button to choose between diagnosis and service statistics
-view_type = st.radio(
-    "Select Statistics Type",
-    options=["Diagnosed Mental Disorders", "Mental Health Service Use","Substance Use"],
-    horizontal=True
-)
 
-if view_type == "Diagnosed Mental Disorders":
-    st.write("This section provides visualization related to the distribution of various diagnosed mental disorders across different demographic groups in the US population.")
-elif view_type == "Mental Health Service Use":
-    st.write("This section compares the number of mental health services received across the states.")
-else:
-    st.write("This section provides visualization related to the strength \
-            of association between substance use and other mental health disorder\
-            diagnoses: which substance abuse conditions are more strongly linked to \
-            specific mental disorders.")
+def cached_or_stop(key: tuple, compute):
+    """Serve `compute` through the result cache, turning NoData into a warning."""
+    try:
+        return cached(key, compute)
+    except NoData as exc:
+        st.warning(str(exc))
+        st.stop()
 
 
-filter_box = st.sidebar.container()
-filter_box.header("Select Demographic Groups")
+def stacked_bar(
+    data: pd.DataFrame, dim: str, view_type: str, selection: Optional[alt.Parameter] = None
+) -> alt.Chart:
+    """
+    The stacked-bar chart of `view_type` measures by `dim`, highlighting the
+    legend-bound `selection` (a new one by default).
+    """
+    _, var_name, _ = VIEW_MEASURES[view_type]
+    legend_title, legend_columns, scale, title = BAR_CHARTS[dim]
+    y_title, y_axis, x_title, title_prefix, width, _ = BAR_VIEWS[view_type]
+    if selection is None:
+        selection = alt.selection_point(fields=[dim], bind="legend")
+    chart = (
+        alt.Chart(data)
+        .mark_bar()
+        .encode(
+            y=alt.Y(f"{var_name}:N", title=y_title, axis=y_axis),
+            x=alt.X("Count:Q", title=x_title),
+            color=alt.Color(f"{dim}:N", legend=horizontal_legend(legend_title, columns=legend_columns), scale=scale),
+            tooltip=[f"{var_name}:N", f"{dim}:N", "Count:Q"],
+            opacity=alt.condition(selection, alt.value(1), alt.value(0.2))
+        )
+        .add_params(selection)
+        .properties(title=f"{title_prefix} Stacked by {title}")
+    )
+    return chart.properties(width=width) if width is not None else chart
 
-# ----- Age -----
-AGE_BIN_EDGES = ["under 15", "15", "25", "35", "45", "55", "65", "over 65"]
 
-age_min, age_max = filter_box.select_slider(
-    "Age range (non-inclusive on max)",
-    options=AGE_BIN_EDGES,
-    value=(AGE_BIN_EDGES[0], AGE_BIN_EDGES[-1]),
-    help="Each point is a bin edge; select a start and end bin."
-)
-age_min = AGE_BIN_EDGES.index(age_min)
-age_max = AGE_BIN_EDGES.index(age_max)
-age_range = AGE_BIN_LABELS[age_min:age_max]
+def shared_bar_data(bars: dict) -> pd.DataFrame:
+    """
+    The five per-dimension bar frames stacked into one (Dimension, Value, ...)
+    frame. Label columns are categoricals, so the chart payload stores each
+    distinct label once (Arrow dictionary encoding) instead of once per row.
+    """
+    data = pd.concat(
+        [
+            counts.rename(columns={dim: "Value"}).assign(Dimension=dim)
+            for dim, counts in bars.items()
+        ],
+        ignore_index=True,
+    )
+    labels = [col for col in data.columns if col != "Count"]
+    return data.astype({col: "category" for col in labels})
 
-# ----- Sex -----
-sex_options = sorted(filter_reference["SEX"].dropna().unique())
 
-selected_sex = filter_box.radio(
-    "Sex (choose one)",
-    options=["Both"] + sex_options,
-    horizontal=True
-)
+def stacked_bar_section(bars: dict, view_type: str) -> None:
+    """Stacked bars of the view's measures by each demographic dimension."""
+    st.subheader("Stacked Bar Charts by Selected Categories")
+    *_, use_container_width = BAR_VIEWS[view_type]
+    if BAR_MODE == "shared":
+        data = shared_bar_data(bars)
+        charts = [
+            stacked_bar(data, dim, view_type)
+            .transform_filter(alt.datum.Dimension == dim)
+            .transform_calculate(**{dim: "datum.Value"})
+            .properties(width=800)
+            for dim in bars
+        ]
+        st.altair_chart(
+            alt.vconcat(*charts).resolve_scale(color="independent").resolve_legend(color="independent"),
+            use_container_width=use_container_width,
+        )
+        return
+    if BAR_MODE != "separate":
+        raise ValueError(f"Unknown MHCLD_BAR_MODE '{BAR_MODE}' (expected 'separate' or 'shared')")
+    for dim, counts in bars.items():
+        st.altair_chart(stacked_bar(counts, dim, view_type), use_container_width=use_container_width)
 
-sex_filter = sex_options if selected_sex == "Both" else [selected_sex]
 
-# ----- Race -----
-race_options = sorted(filter_reference["RACE"].dropna().unique())
-selected_race = filter_box.multiselect(
-    "Race",
-    options=race_options,
-    default=race_options,
-)
+def client_cube(filters: tuple, view_type: str) -> pd.DataFrame:
+    """
+    The view's measures and CLIENT_COUNT per non-empty demographic cell and
+    state matching `filters` (summed over years), with measures named by
+    their display names, for filtering in the browser.
+    """
+    measure_cols, _, names = VIEW_MEASURES[view_type]
+    keys = BAR_DIMENSIONS + ["STATEFIP", "STATEFIP_code"]
+    (cells,) = load_backend().demographic_counts(dict(filters), [keys], measure_cols + ["CLIENT_COUNT"])
+    cells = cells[cells["CLIENT_COUNT"] > 0].reset_index(drop=True)
+    if cells.empty:
+        raise NoData(EMPTY_VIEW_MESSAGES[view_type])
+    # Categorical labels are sent once each (Arrow dictionary encoding) and
+    # per-cell counts fit in the narrowest integer type.
+    cells = cells.astype({col: "category" for col in keys})
+    for col in measure_cols + ["CLIENT_COUNT"]:
+        cells[col] = pd.to_numeric(cells[col], downcast="integer")
+    return cells.rename(columns=names)
 
-# ----- Socio-economic status (EMPLOY) -----
-employ_options = sorted(filter_reference["EMPLOY"].dropna().unique())
-selected_employ = filter_box.multiselect(
-    "Employment / Socio-economic status (EMPLOY)",
-    options=employ_options,
-    default=employ_options,
-)
 
-# ----- Living status (LIVARAG) -----
-livarag_options = sorted(filter_reference["LIVARAG"].dropna().unique())
-selected_livarag = filter_box.multiselect(
-    "Living arrangement / status (LIVARAG)",
-    options=livarag_options,
-    default=livarag_options,
-)
-demographic_subset = apply_demographic_filters(
-    demographic_df,
-    age_range,
-    sex_filter,
-    selected_race,
-    selected_employ,
-    selected_livarag,
-)
-substance_subset = apply_demographic_filters(
-    substance_df,
-    age_range,
-    sex_filter,
-    selected_race,
-    selected_employ,
-    selected_livarag,
-)
+def client_filtered_chart(cube: pd.DataFrame, view_type: str) -> alt.VConcatChart:
+    """
+    The maps and stacked bars of a view as one chart over `cube`, filtered and
+    aggregated in the browser. Clicking legend entries of a stacked bar
+    (shift-click for several) filters every other chart to those values, and a
+    dropdown picks the diagnosis or service shown on the maps, so neither
+    needs a rerun of the script.
+    """
+    measure_cols, var_name, names = VIEW_MEASURES[view_type]
+    labels = [names[col] for col in measure_cols]
+    measure = alt.param(
+        name="measure", value=labels[0], bind=alt.binding_select(options=labels, name=f"Select {var_name} ")
+    )
+    selections = {dim: alt.selection_point(fields=[dim], bind="legend") for dim in BAR_DIMENSIONS}
 
+    def filtered(chart: alt.Chart, skip: Optional[str] = None) -> alt.Chart:
+        for dim, selection in selections.items():
+            if dim != skip:
+                chart = chart.transform_filter(selection)
+        return chart
 
-# ----- Conditional rendering based on view type -----
-if view_type == "Diagnosed Mental Disorders":
-    if demographic_subset.empty:
-        st.warning("No diagnosed disorders found for the selected demographic filters.")
-        st.stop()
+    states = (
+        filtered(alt.Chart(cube))
+        .transform_calculate(Count="datum[measure]")
+        .transform_aggregate(Count="sum(Count)", TotalClients="sum(CLIENT_COUNT)", groupby=["STATEFIP", "STATEFIP_code"])
+        .transform_filter("datum.Count > 0")
+        .transform_calculate(RatePercent="100 * datum.Count / datum.TotalClients")
+        .transform_lookup(lookup="STATEFIP_code", from_=alt.LookupData(load_state_geometry(), key="id"), as_="geo")
+        .transform_filter("isValid(datum.geo)")
+        .mark_geoshape(stroke="white")
+        .project(type="albersUsa")
+        .properties(width=320, height=400)
+    )
+    tooltip = [
+        alt.Tooltip("STATEFIP:N", title="State"),
+        alt.Tooltip("Count:Q", title="Count"),
+        alt.Tooltip("RatePercent:Q", title="Percent of Clients", format=".2f"),
+    ]
+    count_map = state_background() + states.encode(
+        shape="geo:G",
+        color=alt.Color("Count:Q", scale=alt.Scale(type="log", scheme="blues"), title="Count"),
+        tooltip=tooltip,
+    ).properties(title=alt.Title(alt.ExprRef("'Number of clients with ' + measure")))
+    rate_map = state_background() + states.encode(
+        shape="geo:G",
+        color=alt.Color("RatePercent:Q", scale=alt.Scale(scheme="tealblues"), title="Share of clients (%)"),
+        tooltip=tooltip,
+    ).properties(title=alt.Title(alt.ExprRef("'Share of clients with ' + measure + ' (%)'")))
+
+    bars = []
+    for dim, selection in selections.items():
+        bar = (
+            filtered(stacked_bar(cube, dim, view_type, selection), skip=dim)
+            .transform_aggregate([alt.AggregatedFieldDef(op="sum", field=label, **{"as": label}) for label in labels], groupby=[dim])
+            .transform_fold(labels, as_=[var_name, "Count"])
+            .transform_filter("datum.Count > 0")
+            .properties(width=800)
+        )
+        bars.append(bar)
 
-    state_totals = (
-        demographic_subset.groupby(["STATEFIP", "STATEFIP_code"], as_index=False)["CLIENT_COUNT"]
-        .sum()
-        .rename(columns={"CLIENT_COUNT": "TotalClients"})
+    return (
+        alt.vconcat(count_map, rate_map, *bars)
+        .add_params(measure)
+        .resolve_scale(color="independent")
+        .resolve_legend(color="independent")
     )
 
-    long_df = demographic_subset.melt(
-        id_vars=["AGE", "RACE", "SEX", "EMPLOY", "LIVARAG", "STATEFIP", "STATEFIP_code"],
-        value_vars=DIAGNOSIS_COLS,
-        var_name="Diagnosis",
-        value_name="Count"
+
+def client_filtered_section(filters: tuple, view_type: str) -> None:
+    """Maps and stacked bars of a view, filtered in the browser (see client_filtered_chart)."""
+    cube = cached_or_stop(("client", filters, view_type), lambda: client_cube(filters, view_type))
+    st.subheader("Maps and Stacked Bar Charts, Filtered in the Browser")
+    st.write(
+        "Pick the diagnosis or service shown on the maps from the dropdown below the charts. "
+        "Click legend entries of a stacked bar chart (shift-click for several) to filter all other charts to them."
     )
-    long_df = long_df[long_df["Count"] > 0]
-    long_df_copy = long_df.copy()
-    long_df_copy["Diagnosis"] = long_df_copy["Diagnosis"].map(FLAG_TO_NAME)
+    st.altair_chart(client_filtered_chart(cube, view_type), use_container_width=False)
+
 
+# Sections with their own widgets are fragments: changing one of those widgets
+# reruns (and re-sends the charts of) that section only, not the whole page.
+@st.fragment
+def diagnosis_map_section(filters: tuple, view_type: str, state_long: pd.DataFrame) -> None:
+    """Diagnosis selector and the count and rate maps of the selected diagnosis."""
     # -----map-----
     st.subheader("Geographical Distribution of Diagnosed Mental Disorders Across US States")
     st.write("Select a mental disorder from the dropdown to visualize its distribution.")
-    diagnosis_options = long_df_copy["Diagnosis"].dropna().unique()
+    diagnosis_options = state_long["Diagnosis"].dropna().unique()
     if len(diagnosis_options) == 0:
         st.warning("No diagnoses available after filtering.")
         st.stop()
@@ -240,27 +665,9 @@ if view_type == "Diagnosed Mental Disorders":
     )
 
     # Data aggregation for plotting
-    agg_map = (
-        long_df_copy[long_df_copy["Diagnosis"] == selected_diagnosis]
-        .groupby(["STATEFIP", "STATEFIP_code", "Diagnosis"], as_index=False)["Count"]
-        .sum()
-    )
-    agg_map['STATEFIP_code'] = agg_map['STATEFIP_code'].astype(str)
-    map_data = agg_map.merge(state_totals, on=["STATEFIP", "STATEFIP_code"], how="left")
-    map_data["RatePercent"] = (
-        map_data["Count"] / map_data["TotalClients"].replace({0: pd.NA})
-    ).fillna(0) * 100
-    states = alt.topo_feature(data.us_10m.url, 'states')
-
-    background = alt.Chart(states).mark_geoshape(
-        fill='lightgray',
-        stroke='white'
-    ).project(
-        type='albersUsa'
-    ).properties(
-        width=320,
-        height=400
-    )   
+    map_data = cached(("map", filters, view_type, selected_diagnosis), lambda: map_view(filters, view_type, selected_diagnosis))
+    states = load_state_geometry()
+    background = state_background()
 
     map_chart = alt.Chart(states).mark_geoshape(  
         stroke='white',    
@@ -320,186 +727,14 @@ if view_type == "Diagnosed Mental Disorders":
 
     st.altair_chart(final_chart, use_container_width=True)
 
-    # ----- stacked bar charts -----
-    st.subheader("Stacked Bar Charts by Selected Categories")
 
-    # ----- Sex -----
-    agg = (
-        long_df.groupby(["Diagnosis", "SEX"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Diagnosis"] = agg["Diagnosis"].map(FLAG_TO_NAME)
-    sex_selection = alt.selection_point(fields=["SEX"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y("Diagnosis:N", title="Disorder Type", axis=alt.Axis(labelLimit=300)),
-                x=alt.X("Count:Q", title="Number of Diagnoses"),
-                color=alt.Color(
-                    "SEX:N",
-                    legend=horizontal_legend("Sex"),
-                    scale=alt.Scale(domain=["Female", "Male", "Missing"], range=["#e78ac3", "#8da0cb", "#e41a1c"]),
-                ),
-                tooltip=["Diagnosis:N", "SEX:N", "Count:Q"],
-                opacity=alt.condition(sex_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(sex_selection)
-            .properties(
-                title="Diagnosis Stacked by Sex"
-            )
-        ),
-        use_container_width=True
-    )
-
-    # ----- Age -----
-    agg = (
-        long_df.groupby(["Diagnosis", "AGE"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Diagnosis"] = agg["Diagnosis"].map(FLAG_TO_NAME)
-    age_selection = alt.selection_point(fields=["AGE"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y("Diagnosis:N", title="Disorder Type", axis=alt.Axis(labelLimit=300)),
-                x=alt.X("Count:Q", title="Number of Diagnoses"),
-                color=alt.Color(
-                    "AGE:N",
-                    scale=alt.Scale(scheme="blues", domain=AGE_BIN_LABELS),
-                    legend=horizontal_legend("Age", columns=4)
-                ),
-                tooltip=["Diagnosis:N", "AGE:N", "Count:Q"],
-                opacity=alt.condition(age_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(age_selection)
-            .properties(
-                title="Diagnosis Stacked by Age"
-            )
-        ),
-        use_container_width=True
-    )
-
-    # ----- Race -----
-    agg = (
-        long_df.groupby(["Diagnosis", "RACE"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Diagnosis"] = agg["Diagnosis"].map(FLAG_TO_NAME)
-    race_selection = alt.selection_point(fields=["RACE"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y("Diagnosis:N", title="Disorder Type", axis=alt.Axis(labelLimit=300)),
-                x=alt.X("Count:Q", title="Number of Diagnoses"),
-                color=alt.Color(
-                    "RACE:N",
-                    legend=horizontal_legend("Race", columns=4),
-                    scale=alt.Scale(scheme='set3')
-                ),
-                tooltip=["Diagnosis:N", "RACE:N", "Count:Q"],
-                opacity=alt.condition(race_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(race_selection)
-            .properties(
-                title="Diagnosis Stacked by Race",
-                width=5000
-            )
-        ),
-        use_container_width=True
-    )
-
-    # ----- Social-econ status -----
-    agg = (
-        long_df.groupby(["Diagnosis", "EMPLOY"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Diagnosis"] = agg["Diagnosis"].map(FLAG_TO_NAME)
-    employ_selection = alt.selection_point(fields=["EMPLOY"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y("Diagnosis:N", title="Disorder Type", axis=alt.Axis(labelLimit=300)),
-                x=alt.X("Count:Q", title="Number of Diagnoses"),
-                color=alt.Color(
-                    "EMPLOY:N",
-                    legend=horizontal_legend("Social-Economic Status"),
-                    scale=alt.Scale(scheme='tableau10')
-                ),
-                tooltip=["Diagnosis:N", "EMPLOY:N", "Count:Q"],
-                opacity=alt.condition(employ_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(employ_selection)
-            .properties(
-                title="Diagnosis Stacked by Social-Economic Status (EMPLOY)"
-            )
-        ),
-        use_container_width=True
-    )
-
-    # ----- Living status -----
-    agg = (
-        long_df.groupby(["Diagnosis", "LIVARAG"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Diagnosis"] = agg["Diagnosis"].map(FLAG_TO_NAME)
-    livarag_selection = alt.selection_point(fields=["LIVARAG"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y("Diagnosis:N", title="Disorder Type", axis=alt.Axis(labelLimit=300)),
-                x=alt.X("Count:Q", title="Number of Diagnoses"),
-                color=alt.Color(
-                    "LIVARAG:N",
-                    legend=horizontal_legend("Living Status"),
-                    scale=alt.Scale(scheme='set2')
-                ),
-                tooltip=["Diagnosis:N", "LIVARAG:N", "Count:Q"],
-                opacity=alt.condition(livarag_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(livarag_selection)
-            .properties(
-                title="Diagnosis Stacked by Living Status (LIVARAG)"
-            )
-        ),
-        use_container_width=True
-    )
-
-elif view_type == "Mental Health Service Use": # Mental Health Service Use
-    if demographic_subset.empty:
-        st.warning("No service utilization data matched the selected demographic filters.")
-        st.stop()
-
-    state_totals = (
-        demographic_subset.groupby(["STATEFIP", "STATEFIP_code"], as_index=False)["CLIENT_COUNT"]
-        .sum()
-        .rename(columns={"CLIENT_COUNT": "TotalClients"})
-    )
-
-    long_df = demographic_subset.melt(
-        id_vars=["AGE", "RACE", "SEX", "EMPLOY", "LIVARAG", "STATEFIP", "STATEFIP_code"],
-        value_vars=SERVICE_COLS,
-        var_name="Service",
-        value_name="Count"
-    )
-    
-    long_df = long_df[long_df["Count"] > 0]
-    long_df_copy = long_df.copy()
-    long_df_copy["Service"] = long_df_copy["Service"].map(SERVICE_TO_NAME)
-    
+@st.fragment
+def service_map_section(filters: tuple, view_type: str, state_long: pd.DataFrame) -> None:
+    """Service selector and the count and rate maps of the selected service."""
     # -----map-----
     st.subheader("Geographical Distribution of Mental Health Service Use Across US States")
     st.write("Select a mental health service type from the dropdown to visualize its distribution.")
-    service_options = long_df_copy["Service"].dropna().unique()
+    service_options = state_long["Service"].dropna().unique()
     if len(service_options) == 0:
         st.warning("No services available after filtering.")
         st.stop()
@@ -510,28 +745,10 @@ elif view_type == "Mental Health Service Use": # Mental Health Service Use
     )
     
     # Data aggregation for plotting
-    agg_map = (
-        long_df_copy[long_df_copy["Service"] == selected_service]
-        .groupby(["STATEFIP", "STATEFIP_code", "Service"], as_index=False)["Count"]
-        .sum()
-    )
-    agg_map['STATEFIP_code'] = agg_map['STATEFIP_code'].astype(str)
-    map_data = agg_map.merge(state_totals, on=["STATEFIP", "STATEFIP_code"], how="left")
-    map_data["RatePercent"] = (
-        map_data["Count"] / map_data["TotalClients"].replace({0: pd.NA})
-    ).fillna(0) * 100
+    map_data = cached(("map", filters, view_type, selected_service), lambda: map_view(filters, view_type, selected_service))
     
-    states = alt.topo_feature(data.us_10m.url, 'states')
-
-    background = alt.Chart(states).mark_geoshape(
-        fill='lightgray',
-        stroke='white'
-    ).project(
-        type='albersUsa'
-    ).properties(
-        width=320,
-        height=400
-    )
+    states = load_state_geometry()
+    background = state_background()
     
     map_chart = alt.Chart(states).mark_geoshape(  
         stroke='white'     
@@ -580,187 +797,11 @@ elif view_type == "Mental Health Service Use": # Mental Health Service Use
     final_chart = alt.vconcat(count_plot, rate_plot).resolve_scale(color="independent")
     
     st.altair_chart(final_chart, use_container_width=True)
-    
-    # ----- stacked bar charts -----
-    st.subheader("Stacked Bar Charts by Selected Categories")
-
-    # ----- Sex -----
-    agg = (
-        long_df.groupby(["Service", "SEX"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Service"] = agg["Service"].map(SERVICE_TO_NAME)
-    service_sex_selection = alt.selection_point(fields=["SEX"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y(
-                    "Service:N",
-                    title="Service Type",
-                    axis=alt.Axis(labelLimit=300, labelPadding=10, titlePadding=80)
-                ),
-                x=alt.X("Count:Q", title="Number of Service Uses"),
-                color=alt.Color(
-                    "SEX:N",
-                    legend=horizontal_legend("Sex"),
-                    scale=alt.Scale(domain=["Female", "Male", "Missing"], range=["#e78ac3", "#8da0cb", "#e41a1c"]),
-                ),
-                tooltip=["Service:N", "SEX:N", "Count:Q"],
-                opacity=alt.condition(service_sex_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(service_sex_selection)
-            .properties(
-                title="Service Use Stacked by Sex",
-                width = 800
-            )
-        ),
-        use_container_width=False
-    )
-
-    # ----- Age -----
-    agg = (
-        long_df.groupby(["Service", "AGE"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Service"] = agg["Service"].map(SERVICE_TO_NAME)
-    service_age_selection = alt.selection_point(fields=["AGE"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y(
-                    "Service:N",
-                    title="Service Type",
-                    axis=alt.Axis(labelLimit=300, labelPadding=10, titlePadding=80)
-                ),
-                x=alt.X("Count:Q", title="Number of Service Uses"),
-                color=alt.Color(
-                    "AGE:N",
-                    scale=alt.Scale(scheme="blues", domain=AGE_BIN_LABELS),
-                    legend=horizontal_legend("Age", columns=4)
-                ),
-                tooltip=["Service:N", "AGE:N", "Count:Q"],
-                opacity=alt.condition(service_age_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(service_age_selection)
-            .properties(
-                title="Service Use Stacked by Age",
-                width=800
-            )
-        ),
-        use_container_width=False
-    )
-
-    # ----- Race -----
-    agg = (
-        long_df.groupby(["Service", "RACE"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Service"] = agg["Service"].map(SERVICE_TO_NAME)
-    service_race_selection = alt.selection_point(fields=["RACE"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y(
-                    "Service:N",
-                    title="Service Type",
-                    axis=alt.Axis(labelLimit=300, labelPadding=10, titlePadding=80)
-                ),
-                x=alt.X("Count:Q", title="Number of Service Uses"),
-                color=alt.Color(
-                    "RACE:N",
-                    legend=horizontal_legend("Race", columns=4),
-                    scale=alt.Scale(scheme='set3')
-                ),
-                tooltip=["Service:N", "RACE:N", "Count:Q"],
-                opacity=alt.condition(service_race_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(service_race_selection)
-            .properties(
-                title="Service Use Stacked by Race",
-                width=800
-            )
-        ),
-        use_container_width=False
-    )
 
-    # ----- Social-econ status -----
-    agg = (
-        long_df.groupby(["Service", "EMPLOY"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Service"] = agg["Service"].map(SERVICE_TO_NAME)
-    service_employ_selection = alt.selection_point(fields=["EMPLOY"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y(
-                    "Service:N",
-                    title="Service Type",
-                    axis=alt.Axis(labelLimit=300, labelPadding=10, titlePadding=80)
-                ),
-                x=alt.X("Count:Q", title="Number of Service Uses"),
-                color=alt.Color(
-                    "EMPLOY:N",
-                    legend=horizontal_legend("Social-Economic Status"),
-                    scale = alt.Scale(scheme='tableau10')
-                ),
-                tooltip=["Service:N", "EMPLOY:N", "Count:Q"],
-                opacity=alt.condition(service_employ_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(service_employ_selection)
-            .properties(
-                title="Service Use Stacked by Social-Economic Status (EMPLOY)",
-                width=800
-            )
-        ),
-        use_container_width=False
-    )
 
-    # ----- Living status -----
-    agg = (
-        long_df.groupby(["Service", "LIVARAG"], as_index=False)["Count"]
-        .sum()
-    )
-    agg["Service"] = agg["Service"].map(SERVICE_TO_NAME)
-    service_livarag_selection = alt.selection_point(fields=["LIVARAG"], bind="legend")
-    st.altair_chart(
-        (
-            alt.Chart(agg)
-            .mark_bar()
-            .encode(
-                y=alt.Y(
-                    "Service:N",
-                    title="Service Type",
-                    axis=alt.Axis(labelLimit=300, labelPadding=10, titlePadding=80)
-                ),
-                x=alt.X("Count:Q", title="Number of Service Uses"),
-                color=alt.Color(
-                    "LIVARAG:N",
-                    legend=horizontal_legend("Living Status"),
-                    scale=alt.Scale(scheme='set2')
-                ),
-                tooltip=["Service:N", "LIVARAG:N", "Count:Q"],
-                opacity=alt.condition(service_livarag_selection, alt.value(1), alt.value(0.2))
-            )
-            .add_params(service_livarag_selection)
-            .properties(
-                title="Service Use Stacked by Living Status (LIVARAG)",
-                width=800
-            )
-        ),
-        use_container_width=False
-    )
-else:
-    
-    
+@st.fragment
+def substance_section(filters: tuple) -> None:
+    """Substance-use diagnosis selector and the matching substance-use charts."""
     st.subheader('Whether People Have a Substance Use Diagnosis or Not')
     dia = st.radio('Filter to only people WITH a substance use diagnosis?', ['YES','NO'])
     st.write("If you choose yes, the plots will focus on population with\
@@ -769,47 +810,30 @@ else:
             health disorder distribution differs for the population with a \
             substance-related problem, but no diagnosis, and the population with no \
             substance-related problem ")
-    subset = substance_subset[substance_subset["SUB_dia"] == dia]
-    if subset.empty:
-        st.warning("No records matched the selected demographic filters for this substance-use view.")
-        st.stop()
-
     if dia == 'YES':
-        subset = subset.dropna(subset=["SUB"])
-        if subset.empty:
-            st.warning("No substance-use diagnoses available for the selected filters.")
-            st.stop()
-
-        subset = subset.melt(
-            id_vars=["SUB"],
-            value_vars=DIAGNOSIS_COLS,
-            var_name="types_reported",
-            value_name="mh"
-        )
-        subset = (
-            subset.groupby(["SUB", "types_reported"], as_index=False)["mh"]
-            .sum()
-        )
-        subset = subset[subset["mh"] > 0]
-        if subset.empty:
-            st.warning("No diagnosis counts available for the selected substance-use category.")
-            st.stop()
-        subset["types_reported"] = subset["types_reported"].map(TYPE_MAP).fillna(subset["types_reported"])
+        subset = cached_or_stop(("substance", filters, dia), lambda: substance_heatmap_view(filters))
         brush = alt.selection_interval(encodings=['x'], name="diag_brush")
+        metric = st.selectbox("Color the matrix by", list(ASSOCIATION_METRICS))
+        metric_field, metric_scale, metric_title = ASSOCIATION_METRICS[metric]
         
         chart = alt.Chart(subset).mark_rect().encode(
             x=alt.X("types_reported:N", title="Mental health disorders",axis=alt.Axis(labelLimit=300)),
             y=alt.Y("SUB:N", title="Substance-related disorders",axis=alt.Axis(labelLimit=300)),
-            color=alt.Color("mh:Q", scale=alt.Scale(type='log', clamp=True), legend=alt.Legend(title='log(count)')),
+            color=alt.Color(f"{metric_field}:Q", scale=metric_scale, legend=alt.Legend(title=metric_title)),
             tooltip=[
                 alt.Tooltip("mh:Q", title="count"),
                 alt.Tooltip("SUB", title="Substance disorders"),
-                alt.Tooltip("types_reported", title="Mental health disorders")
+                alt.Tooltip("types_reported", title="Mental health disorders"),
+                alt.Tooltip("conditional:Q", title="P(diagnosis | substance)", format=".1%"),
+                alt.Tooltip("conditional_low:Q", title="95% CI low", format=".1%"),
+                alt.Tooltip("conditional_high:Q", title="95% CI high", format=".1%"),
+                alt.Tooltip("lift:Q", title="lift", format=".2f"),
+                alt.Tooltip("odds_ratio:Q", title="odds ratio", format=".2f"),
+                alt.Tooltip("odds_ratio_low:Q", title="odds ratio 95% CI low", format=".2f"),
+                alt.Tooltip("odds_ratio_high:Q", title="odds ratio 95% CI high", format=".2f"),
+                alt.Tooltip("chi_square:Q", title="chi-square", format=".1f"),
+                alt.Tooltip("p_value:Q", title="p-value", format=".2g"),
                 ],).properties(width=500).add_params(brush)
-        t = subset.groupby(["SUB"])['mh'].sum()
-        map_pop = dict(zip(t.index.values, t.values))
-        subset['pop'] = subset['SUB'].map(map_pop)
-        subset['percentage'] = subset['mh']/subset['pop']
         st.write("Please select columns from the matrix above by dragging to see the corresponding sum of percentage in the barplot below.")
         chart_bar = alt.Chart(subset
                             ).mark_bar().encode(x=alt.X("sum(percentage):Q",title = 'Sum of percentage',
@@ -824,25 +848,7 @@ else:
         combine_c = alt.vconcat(chart, chart_bar)
         st.altair_chart(combine_c, use_container_width=True)
     if dia == 'NO':
-        subset = subset.melt(
-            id_vars=["SAP"],
-            value_vars=DIAGNOSIS_COLS,
-            var_name="types_reported",
-            value_name="mh"
-        )
-        subset = (
-            subset.groupby(['types_reported','SAP'], as_index=False)["mh"]
-            .sum()
-        )
-        subset = subset[subset["mh"] > 0]
-        if subset.empty:
-            st.warning("No counts available for the selected filters and SAP grouping.")
-            st.stop()
-        subset['SAP'] = subset['SAP'].fillna('missing').astype(str)
-        
-        SAP_map = {'1.0':'problem','0.0':'no problem','missing': 'missing'}
-        subset['SAP'] = subset['SAP'].map(SAP_map).fillna(subset['SAP'])
-        subset['types_reported'] = subset['types_reported'].map(TYPE_MAP).fillna(subset['types_reported'])
+        subset = cached_or_stop(("substance", filters, dia), lambda: sap_view(filters))
         sap_selection = alt.selection_point(fields=["SAP"], bind="legend")
         click_selection = alt.selection_single(fields = ['SAP'],bind = 'legend')
         
@@ -865,3 +871,160 @@ else:
         #plot2 = plot2.configure_title(fontSize = 15, anchor = 'middle')
         combine_c2 = alt.vconcat(plot2, plot3)
         st.altair_chart( combine_c2, use_container_width=True)
+
+# create two tabs (merged tab 1 and 3)
+#tab1, tab2 = st.tabs(["Diagnosed Mental Disorders & Mental Health Service", "Substance Use"])
+
+# content for merged tab1
+#with tab1:
+st.header(" Mental Health Client-Level Data (MH-CLD) Visualizer ")
+
+# Add radio button to choose between diagnosis and service statistics
+view_type = st.radio(
+    "Select Statistics Type",
+    options=["Diagnosed Mental Disorders", "Mental Health Service Use","Substance Use"],
+    horizontal=True
+)
+
+if view_type == "Diagnosed Mental Disorders":
+    st.write("This section provides visualization related to the distribution of various diagnosed mental disorders across different demographic groups in the US population.")
+elif view_type == "Mental Health Service Use":
+    st.write("This section compares the number of mental health services received across the states.")
+else:
+    st.write("This section provides visualization related to the strength \
+            of association between substance use and other mental health disorder\
+            diagnoses: which substance abuse conditions are more strongly linked to \
+            specific mental disorders.")
+
+
+filter_box = st.sidebar.container()
+filter_box.header("Select Demographic Groups")
+
+# ----- Year -----
+# Counts from different years are summed when several are selected; the
+# latest year is shown by default.
+year_options = [int(year) for year in filter_options(YEAR_COL)]
+selected_years = None
+if year_options:
+    selected_years = filter_box.multiselect(
+        "Year",
+        options=year_options,
+        default=year_options[-1:],
+    )
+
+# ----- Browser-side filtering -----
+# The maps and stacked bars can be filtered in the browser instead (see
+# client_filtered_chart); the demographic filters below then do not apply.
+client_side = view_type in VIEW_MEASURES and filter_box.toggle(
+    "Filter in the browser",
+    value=CLIENT_FILTERING,
+    help="Send the view's aggregates once and filter the maps and stacked bars by clicking their legends, without reloading.",
+)
+
+# ----- Age -----
+AGE_BIN_EDGES = ["under 15", "15", "25", "35", "45", "55", "65", "over 65"]
+
+age_min, age_max = filter_box.select_slider(
+    "Age range (non-inclusive on max)",
+    options=AGE_BIN_EDGES,
+    value=(AGE_BIN_EDGES[0], AGE_BIN_EDGES[-1]),
+    help="Each point is a bin edge; select a start and end bin.",
+    disabled=client_side,
+)
+age_min = AGE_BIN_EDGES.index(age_min)
+age_max = AGE_BIN_EDGES.index(age_max)
+age_range = AGE_BIN_LABELS[age_min:age_max]
+
+# ----- Sex -----
+sex_options = filter_options("SEX")
+
+selected_sex = filter_box.radio(
+    "Sex (choose one)",
+    options=["Both"] + sex_options,
+    horizontal=True,
+    disabled=client_side,
+)
+
+sex_filter = sex_options if selected_sex == "Both" else [selected_sex]
+
+# ----- Race -----
+race_options = filter_options("RACE")
+selected_race = filter_box.multiselect(
+    "Race",
+    options=race_options,
+    default=race_options,
+    disabled=client_side,
+)
+
+# ----- Socio-economic status (EMPLOY) -----
+employ_options = filter_options("EMPLOY")
+selected_employ = filter_box.multiselect(
+    "Employment / Socio-economic status (EMPLOY)",
+    options=employ_options,
+    default=employ_options,
+    disabled=client_side,
+)
+
+# ----- Living status (LIVARAG) -----
+livarag_options = filter_options("LIVARAG")
+selected_livarag = filter_box.multiselect(
+    "Living arrangement / status (LIVARAG)",
+    options=livarag_options,
+    default=livarag_options,
+    disabled=client_side,
+)
+if client_side:
+    # Every demographic group is sent; the browser does the filtering.
+    age_range, sex_filter = AGE_BIN_LABELS, sex_options
+    selected_race, selected_employ, selected_livarag = race_options, employ_options, livarag_options
+filters = normalize_filters(age_range, sex_filter, selected_race, selected_employ, selected_livarag, selected_years)
+cache_stats = load_result_cache().stats()
+filter_box.caption(
+    f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+    f"{cache_stats['size']}/{cache_stats['maxsize']} entries"
+)
+memory = load_aggregated_data().memory_report()
+filter_box.caption(
+    f"Aggregates in memory: {memory['bytes'].sum() / 2**20:.1f} MiB "
+    f"({memory['loaded_bytes'].sum() / 2**20:.1f} MiB as read)"
+)
+
+
+# ----- Conditional rendering based on view type -----
+if view_type == "Diagnosed Mental Disorders":
+    if client_side:
+        client_filtered_section(filters, view_type)
+    else:
+        view = cached_or_stop(("view", filters, view_type), lambda: demographic_view(filters, view_type))
+        diagnosis_map_section(filters, view_type, view["state_long"])
+
+        stacked_bar_section(view["bars"], view_type)
+
+    # ----- Comorbidity -----
+    if load_comorbidity_cube() is not None:
+        st.subheader("Co-occurring Diagnoses")
+        st.write("Number of clients reporting both diagnoses; the diagonal counts clients with each diagnosis.")
+        pairs = cached(("comorbidity", filters), lambda: comorbidity_view(filters))
+        st.altair_chart(
+            alt.Chart(pairs)
+            .mark_rect()
+            .encode(
+                x=alt.X("Co-occurring diagnosis:N", axis=alt.Axis(labelLimit=300)),
+                y=alt.Y("Diagnosis:N", axis=alt.Axis(labelLimit=300)),
+                color=alt.Color("Clients:Q", scale=alt.Scale(type='log', scheme='blues'), title='Clients'),
+                tooltip=["Diagnosis:N", "Co-occurring diagnosis:N", "Clients:Q"],
+            )
+            .properties(title="Diagnosis Co-occurrence"),
+            use_container_width=True
+        )
+
+elif view_type == "Mental Health Service Use": # Mental Health Service Use
+    if client_side:
+        client_filtered_section(filters, view_type)
+    else:
+        view = cached_or_stop(("view", filters, view_type), lambda: demographic_view(filters, view_type))
+        service_map_section(filters, view_type, view["state_long"])
+
+        stacked_bar_section(view["bars"], view_type)
+else:
+    substance_section(filters)
@@ -0,0 +1,49 @@
+"""
+Diagnosis co-occurrence (comorbidity) matrices per demographic cell.
+
+precompute_stats.py writes comorbidity_stats: for every demographic cell and
+pair of diagnosis flags (upper triangle, diagonal included) the number of
+clients reporting both. Loaded into a DataCube, a filter selection is sliced
+and summed to one 13x13 matrix without touching the record-level data.
+"""
+
+from __future__ import annotations
+
+from typing import List, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+from data_cube import DataCube
+
+
+CELL_DIMENSIONS: List[str] = ["AGE", "RACE", "SEX", "EMPLOY", "LIVARAG"]
+# Cell dimensions of aggregates built from yearly sources.
+OPTIONAL_DIMENSIONS: List[str] = ["YEAR"]
+
+
+class ComorbidityCube:
+    """Co-occurrence counts indexed by demographic cell and diagnosis pair."""
+
+    def __init__(self, pairs: pd.DataFrame, diagnoses: List[str]):
+        """`pairs` is the comorbidity_stats frame; `diagnoses` fixes the matrix order."""
+        self.diagnoses = diagnoses
+        axes = {dim: [dim] for dim in CELL_DIMENSIONS + OPTIONAL_DIMENSIONS if dim in pairs.columns}
+        axes.update({"DIAG_A": ["DIAG_A"], "DIAG_B": ["DIAG_B"]})
+        self.cube = DataCube.from_frame(pairs, axes, ["CLIENT_COUNT"])
+
+    def matrix(self, selection: Mapping[str, Sequence]) -> pd.DataFrame:
+        """
+        Symmetric diagnoses x diagnoses frame of clients reporting both,
+        summed over the cells matching `selection` (as in DataCube.select).
+        The diagonal holds the number of clients with each diagnosis.
+        """
+        pairs = self.cube.select(selection).reduce(["DIAG_A", "DIAG_B"])
+        upper = (
+            pairs.pivot(index="DIAG_A", columns="DIAG_B", values="CLIENT_COUNT")
+            .reindex(index=self.diagnoses, columns=self.diagnoses)
+            .fillna(0)
+            .to_numpy(dtype=np.int64)
+        )
+        full = upper + upper.T - np.diag(np.diag(upper))
+        return pd.DataFrame(full, index=self.diagnoses, columns=self.diagnoses)
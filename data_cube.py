@@ -0,0 +1,144 @@
+"""
+Dense in-memory count cube over the pre-aggregated MHCLD statistics.
+
+A DataCube holds one integer count per (axis label, ..., measure), so a
+demographic filter selection is index slicing along each axis and every
+dashboard aggregate (state totals, stacked-bar groups) is a sum over the
+remaining axes. The cost of a query depends on the cube shape, not on how
+many rows the aggregate files contain.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class DataCube:
+    """
+    N-dimensional array of summed measures.
+
+    Each axis is described by a frame of its labels: usually one column (e.g.
+    "SEX"), but several columns can share one axis when they are functionally
+    dependent, like the state name and its FIPS code. The last array axis
+    enumerates the measures.
+    """
+
+    def __init__(self, axes: Dict[str, pd.DataFrame], measures: List[str], values: np.ndarray):
+        self.axes = axes
+        self.measures = measures
+        self.values = values
+        # Label columns as object arrays, built on first use by axis_index.
+        self.label_arrays: Dict[tuple, np.ndarray] = {}
+
+    @classmethod
+    def from_frame(
+        cls,
+        df: pd.DataFrame,
+        axes: Mapping[str, Sequence[str]],
+        measures: List[str],
+    ) -> "DataCube":
+        """
+        Build a cube from a long aggregate frame.
+        `axes` maps each axis name to the column(s) that label it.
+        """
+        axis_labels: Dict[str, pd.DataFrame] = {}
+        axis_codes = []
+        for name, columns in axes.items():
+            columns = list(columns)
+            codes = df.groupby(columns, dropna=False, observed=True, sort=True).ngroup().to_numpy()
+            labels = (
+                df[columns]
+                .assign(_code=codes)
+                .drop_duplicates("_code")
+                .sort_values("_code")
+                .drop(columns="_code")
+                .reset_index(drop=True)
+            )
+            axis_labels[name] = labels
+            axis_codes.append(codes)
+
+        shape = tuple(len(labels) for labels in axis_labels.values())
+        cells = np.ravel_multi_index(axis_codes, shape) if axis_codes else np.zeros(len(df), dtype=np.intp)
+        size = int(np.prod(shape))
+        values = np.empty(shape + (len(measures),), dtype=np.int32)
+        for i, measure in enumerate(measures):
+            weights = df[measure].to_numpy(dtype=np.float64, na_value=0.0)
+            values[..., i] = np.bincount(cells, weights=weights, minlength=size).reshape(shape)
+        return cls(axis_labels, measures, values)
+
+    def axis_index(self, name: str, selection: Mapping[str, Sequence]) -> np.ndarray | None:
+        """
+        Positions along an axis whose labels match every selected column,
+        or None when the selection does not restrict this axis.
+        """
+        mask = None
+        for column in self.axes[name].columns:
+            if column in selection:
+                # Axes hold a few labels each: a set lookup per label is much
+                # cheaper than Series.isin on a selection this small.
+                if (name, column) not in self.label_arrays:
+                    self.label_arrays[name, column] = self.axes[name][column].to_numpy(dtype=object)
+                wanted = set(selection[column])
+                matches = np.fromiter((label in wanted for label in self.label_arrays[name, column]), dtype=bool)
+                mask = matches if mask is None else mask & matches
+        return None if mask is None else np.flatnonzero(mask)
+
+    def select(self, selection: Mapping[str, Sequence]) -> "DataCube":
+        """
+        Restrict the cube to the labels listed per column in `selection`
+        (columns not mentioned are kept whole). Each restricted axis is one
+        `np.take`, applied most selective first so later takes copy less.
+        """
+        restricted = []
+        for axis, name in enumerate(self.axes):
+            index = self.axis_index(name, selection)
+            if index is not None and len(index) < len(self.axes[name]):
+                restricted.append((len(index) / max(len(self.axes[name]), 1), axis, name, index))
+
+        values = self.values
+        axes = dict(self.axes)
+        for _, axis, name, index in sorted(restricted, key=lambda item: item[0]):
+            values = np.take(values, index, axis=axis)
+            axes[name] = axes[name].iloc[index].reset_index(drop=True)
+        return DataCube(axes, self.measures, values)
+
+    def collapse(self, names: Sequence[str]) -> "DataCube":
+        """
+        Sum out the given axes, returning a smaller cube. Collapsing a large
+        axis once lets several later reductions share that work.
+        """
+        drop = tuple(axis for axis, name in enumerate(self.axes) if name in names)
+        axes = {name: labels for name, labels in self.axes.items() if name not in names}
+        return DataCube(axes, self.measures, self.values.sum(axis=drop, dtype=np.int64))
+
+    def totals(self) -> pd.Series:
+        """Sum of every measure over the whole cube."""
+        flat = self.values.reshape(-1, len(self.measures))
+        return pd.Series(flat.sum(axis=0), index=self.measures)
+
+    def reduce(self, keep: Sequence[str], measures: Sequence[str] | None = None) -> pd.DataFrame:
+        """
+        Sum over every axis not in `keep`. Returns a wide frame with the
+        label columns of the kept axes followed by one column per measure.
+        """
+        names = list(self.axes)
+        measures = list(measures) if measures is not None else self.measures
+        positions = [self.measures.index(measure) for measure in measures]
+        drop = tuple(axis for axis, name in enumerate(names) if name not in keep)
+        summed = self.values.sum(axis=drop, dtype=np.int64) if drop else self.values.astype(np.int64)
+        summed = summed[..., positions]
+
+        kept = [name for name in names if name in keep]
+        if kept:
+            grid = np.indices([len(self.axes[name]) for name in kept]).reshape(len(kept), -1)
+            frame = pd.concat(
+                [self.axes[name].iloc[grid[i]].reset_index(drop=True) for i, name in enumerate(kept)],
+                axis=1,
+            )
+        else:
+            frame = pd.DataFrame(index=range(1))
+        counts = pd.DataFrame(summed.reshape(-1, len(measures)), columns=measures)
+        return pd.concat([frame, counts], axis=1)
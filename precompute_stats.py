@@ -4,16 +4,48 @@ Generate compact, aggregated datasets that power the Streamlit dashboard.
 
 Usage:
     python precompute_stats.py --source MHCLD_PUF_2023_clean.csv --output-dir data
+    python precompute_stats.py --source MHCLD_PUF_2023_clean.csv --output-dir data --format parquet
+    python precompute_stats.py --source MHCLD_PUF_2023_clean.csv --output-dir data --workers 4
+    python precompute_stats.py --source MHCLD_PUF_2023.csv --raw --output-dir data
+    python precompute_stats.py --source MHCLD_PUF_2023_clean.csv --output-dir data --cubes cubes.json
+    python precompute_stats.py --source data/MHCLD_PUF_2023_clean --output-dir data --workers 4
+    python precompute_stats.py --source MHCLD_PUF_2023_clean.csv MHCLD_PUF_2024_clean.csv --output-dir data
+    python precompute_stats.py --source puf_extract.csv --year 2024 --output-dir data
+
+Every aggregate ("cube") is described declaratively in CUBES; --cubes adds
+more from a JSON file. All cubes are computed from one streaming pass over
+the source, and a cube that is a roll-up of another is derived from that
+cube's result instead of from the source rows. The source is a cleaned CSV,
+the raw PUF (--raw), or a partitioned dataset directory written by
+clean_data.py, whose files are split between the workers.
+
+Each source holds one year of the PUF. The year is read from its YEAR
+column (the raw PUF and partitioned datasets have one), else from the
+four-digit year in its file name, and --year overrides both.
+Its source cubes are saved as partial aggregates under <output-dir>/partials/
+and recorded in <output-dir>/manifest.json with the source's content hash
+and row count. A later run reprocesses only the sources whose hash changed,
+so adding a year means passing just the new file; the outputs are rebuilt
+from all recorded partials, with a YEAR key in every cube.
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
+import io
+import json
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, List, Optional
 
+import numpy as np
 import pandas as pd
 
+from clean_data import dataset_files, dataset_years, iter_clean_chunks, iter_partitioned_chunks
+
 
 DIAGNOSIS_COLS: List[str] = [
     "TRAUSTREFLG",
@@ -60,9 +92,97 @@ SUBSTANCE_KEYS: List[str] = [
     "SAP",
 ]
 
-USECOLS: List[str] = sorted(
-    set(DIAGNOSIS_COLS + SERVICE_COLS + DEMO_KEYS + ["SUB", "SAP"])
-)
+# Demographic cells of the comorbidity (diagnosis co-occurrence) matrices.
+COMORBIDITY_KEYS: List[str] = [
+    "AGE",
+    "RACE",
+    "SEX",
+    "EMPLOY",
+    "LIVARAG",
+]
+
+# Bit i of DIAGNOSIS_PATTERN is set when DIAGNOSIS_COLS[i] is reported.
+PATTERN_COL = "DIAGNOSIS_PATTERN"
+
+# Keys that are a pure function of another key. The aggregation engine packs
+# only the parent column and attaches the dependent label at decode time.
+DEPENDENT_KEYS = {
+    "STATEFIP": "STATEFIP_code",
+}
+
+MEASURE_COLS: List[str] = DIAGNOSIS_COLS + SERVICE_COLS + ["CLIENT_COUNT"]
+
+# Aggregates written by default, by output name: the key columns to group by,
+# the measure columns to sum and an optional row filter mapping a column to
+# the values to keep. The dashboard reads the first two.
+CUBES: Dict[str, dict] = {
+    "demographic_service_stats": {
+        "keys": DEMO_KEYS,
+        "measures": DIAGNOSIS_COLS + SERVICE_COLS + ["CLIENT_COUNT"],
+    },
+    "substance_stats": {
+        "keys": SUBSTANCE_KEYS,
+        "measures": DIAGNOSIS_COLS + ["CLIENT_COUNT"],
+    },
+    # Diagnosis counts per demographic cell and substance-use disorder (SUB),
+    # and per substance use problem (SAP) among clients without one: the
+    # dashboard's substance x diagnosis matrices, summed over the selected
+    # cells. Both are roll-ups of substance_stats.
+    "substance_diagnosis_stats": {
+        "keys": COMORBIDITY_KEYS + ["SUB"],
+        "measures": DIAGNOSIS_COLS + ["CLIENT_COUNT"],
+        "filter": {"SUB_dia": ["YES"]},
+    },
+    "sap_diagnosis_stats": {
+        "keys": COMORBIDITY_KEYS + ["SAP"],
+        "measures": DIAGNOSIS_COLS + ["CLIENT_COUNT"],
+        "filter": {"SUB_dia": ["NO"]},
+    },
+    # Clients per demographic cell and diagnosis combination; expanded into
+    # comorbidity_stats by comorbidity_pairs() instead of being written.
+    "diagnosis_pattern_stats": {
+        "keys": COMORBIDITY_KEYS + [PATTERN_COL],
+        "measures": ["CLIENT_COUNT"],
+    },
+}
+PATTERN_CUBE = "diagnosis_pattern_stats"
+COMORBIDITY_OUTPUT = "comorbidity_stats"
+
+# Columns added by preprocess() rather than read from the source, and the
+# source columns it always reads.
+DERIVED_COLS = {"SUB_dia", "CLIENT_COUNT", PATTERN_COL}
+PREPROCESS_INPUTS = ["SUB", "SAP"]
+
+# File suffix written for each --format choice. "arrow" is the Arrow IPC
+# (Feather v2) file format, written uncompressed so the dashboard reads it
+# without decompressing; both columnar formats keep the categorical dictionaries and integer
+# widths chosen in to_columnar().
+OUTPUT_SUFFIXES = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+
+# Incremental build state: per-year partial aggregates and the manifest
+# recording which source produced them.
+MANIFEST_FILE = "manifest.json"
+PARTIALS_DIR = "partials"
+YEAR_COL = "YEAR"
+# Rows of a CSV source read to find its year.
+YEAR_SAMPLE_ROWS = 1000
+
+
+# Dimension dictionary written next to the aggregates. Missing values are
+# listed under the same label the dashboard fills them with.
+DIMENSIONS_FILE = "dimensions.json"
+MISSING_LABEL = "Missing"
+
+# Canonical value order for dimensions whose labels do not sort naturally;
+# every other dimension is listed in sorted order.
+DIMENSION_ORDERS: Dict[str, List[str]] = {
+    "AGE": ["Under 15", "15-24", "25-34", "35-44", "45-54", "55-64", "65 and older"],
+}
 
 
 def parse_args() -> argparse.Namespace:
@@ -70,8 +190,26 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--source",
         required=True,
+        nargs="+",
         type=Path,
-        help="Path to the MHCLD_PUF_2023_clean.csv file.",
+        help=(
+            "One or more yearly sources, each a cleaned CSV (MHCLD_PUF_2023_clean.csv), a partitioned "
+            "dataset directory, or the raw PUF with --raw. Years already in the manifest are kept."
+        ),
+    )
+    parser.add_argument(
+        "--year",
+        nargs="+",
+        type=int,
+        help=(
+            "Year of each --source, in the same order. By default it is read from the source's YEAR "
+            "column, or from the year in its file name (cleaned CSVs have no YEAR column)."
+        ),
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Treat --source as the raw MHCLD PUF and clean it on the fly with clean_data.py.",
     )
     parser.add_argument(
         "--output-dir",
@@ -85,57 +223,705 @@ def parse_args() -> argparse.Namespace:
         default=250_000,
         help="Number of rows to process per chunk when streaming the source CSV.",
     )
+    parser.add_argument(
+        "--format",
+        choices=sorted(OUTPUT_SUFFIXES),
+        default="csv",
+        help="File format of the aggregated outputs (default: csv).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes aggregating byte-range partitions of the source (default: 1).",
+    )
+    parser.add_argument(
+        "--cubes",
+        type=Path,
+        help=(
+            "JSON file of extra cubes to build, e.g. "
+            '{"state_substance_stats": {"keys": ["STATEFIP", "STATEFIP_code", "SUB"], '
+            '"measures": ["CLIENT_COUNT"], "filter": {"SUB_dia": ["YES"]}}}. '
+            "Entries with a default cube's name replace it."
+        ),
+    )
+    parser.add_argument(
+        "--scaling-report",
+        action="store_true",
+        help="Time the aggregation with 1, 2, 4, ... up to --workers processes and print the speedups.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Reprocess every --source even if the manifest shows it unchanged.",
+    )
     return parser.parse_args()
 
 
+def sap_labels(sap: pd.Series) -> pd.Categorical:
+    """
+    Label SAP values as their string form, or "missing" when absent, as a
+    categorical with sorted categories. Only the handful of distinct values
+    are converted in Python; rows are mapped through their integer codes.
+    """
+    codes, uniques = pd.factorize(sap)
+    labels = [str(value) for value in uniques] + ["missing"]
+    categories = sorted(set(labels))
+    label_codes = np.array([categories.index(label) for label in labels], dtype=np.int16)
+    codes = np.where(codes < 0, len(uniques), codes)
+    return pd.Categorical.from_codes(label_codes[codes], categories=categories)
+
+
 def preprocess(chunk: pd.DataFrame) -> pd.DataFrame:
-    chunk = chunk.copy()
-    chunk["SUB_dia"] = chunk["SUB"].notna().map({True: "YES", False: "NO"})
-    chunk["SAP"] = chunk["SAP"].apply(
-        lambda val: "missing" if pd.isna(val) else str(val)
+    """
+    Add the derived SUB_dia, SAP label and CLIENT_COUNT columns.
+    The chunk is modified in place; callers pass freshly parsed chunks.
+    """
+    chunk["SUB_dia"] = pd.Categorical.from_codes(
+        chunk["SUB"].notna().to_numpy().astype(np.int8), categories=["NO", "YES"]
     )
-    chunk["CLIENT_COUNT"] = 1
+    chunk["SAP"] = sap_labels(chunk["SAP"])
+    chunk["CLIENT_COUNT"] = np.ones(len(chunk), dtype=np.int64)
     return chunk
 
 
-def aggregate_chunks(
-    source: Path, chunk_size: int
-) -> tuple[pd.DataFrame, pd.DataFrame]:
-    demo_frames: List[pd.DataFrame] = []
-    substance_frames: List[pd.DataFrame] = []
-
-    for chunk in pd.read_csv(
-        source, chunksize=chunk_size, usecols=USECOLS, low_memory=False
-    ):
+def diagnosis_pattern(chunk: pd.DataFrame) -> np.ndarray:
+    """Bitmask of the diagnosis flags reported by each row (missing counts as not reported)."""
+    flags = chunk[DIAGNOSIS_COLS].to_numpy(dtype=np.float64, na_value=0.0) > 0
+    return flags.astype(np.int32) @ (1 << np.arange(len(DIAGNOSIS_COLS), dtype=np.int32))
+
+
+def comorbidity_pairs(patterns: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """
+    Expand (cell, diagnosis pattern) client counts into the upper triangle of
+    each cell's 13x13 co-occurrence matrix: one row per cell and diagnosis
+    pair (DIAG_A <= DIAG_B in DIAGNOSIS_COLS order) with a non-zero number of
+    clients reporting both. The diagonal holds each diagnosis' marginal count.
+
+    Per cell this is X^T diag(c) X over the cell's distinct patterns X with
+    client counts c, computed for all cells at once: the weighted pair
+    products of every pattern row are summed per cell with np.add.reduceat.
+    """
+    n = len(DIAGNOSIS_COLS)
+    first, second = np.triu_indices(n)
+    bits = (patterns[PATTERN_COL].to_numpy(dtype=np.int64)[:, None] >> np.arange(n)) & 1
+    weighted = bits[:, first] * bits[:, second] * patterns["CLIENT_COUNT"].to_numpy(dtype=np.int64)[:, None]
+
+    cell = patterns.groupby(keys, dropna=False, observed=True, sort=False).ngroup().to_numpy()
+    order = np.argsort(cell, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(cell[order]) != 0])
+    counts = np.add.reduceat(weighted[order], starts, axis=0) if len(order) else weighted[:0]
+
+    cell_rows, pair = np.nonzero(counts)
+    result = patterns[keys].iloc[order[starts[cell_rows]]].reset_index(drop=True)
+    result["DIAG_A"] = np.asarray(DIAGNOSIS_COLS)[first[pair]]
+    result["DIAG_B"] = np.asarray(DIAGNOSIS_COLS)[second[pair]]
+    result["CLIENT_COUNT"] = counts[cell_rows, pair]
+    return result
+
+
+def encode_key(column: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    """
+    Dictionary-encode a key column to codes in sorted label order, with NaN
+    (if present) as the last code. Categorical columns with sorted categories
+    reuse their codes instead of hashing the values again.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype) and column.cat.categories.is_monotonic_increasing:
+        codes = column.cat.codes.to_numpy().astype(np.intp)
+        labels = column.cat.categories
+        if (codes < 0).any():
+            codes[codes < 0] = len(labels)
+            labels = labels.insert(len(labels), np.nan)
+        return codes, labels
+    return pd.factorize(column, sort=True, use_na_sentinel=False)
+
+
+def aggregate_packed(
+    frame: pd.DataFrame, keys: List[str], measures: List[str], encoded: Optional[dict] = None
+) -> pd.DataFrame:
+    """
+    Sum `measures` per distinct combination of `keys`, matching
+    `frame.groupby(keys, dropna=False)[measures].sum().reset_index()`.
+
+    Each key column is dictionary-encoded to small integers in sorted order
+    (NaN last) and the codes are packed into a single int64 cell id, so the
+    reduction is one factorization of an integer array followed by
+    `np.bincount` per measure, and sorting the cell ids reproduces the
+    groupby order. Labels are decoded only for the distinct cells.
+
+    `encoded` memoizes the key encodings, so several aggregations of the
+    same frame encode each shared key column once.
+    """
+    encoded = {} if encoded is None else encoded
+    codes_by_key = {}
+    labels_by_key = {}
+    for key in keys:
+        if key in DEPENDENT_KEYS and DEPENDENT_KEYS[key] in keys:
+            continue
+        if key not in encoded:
+            encoded[key] = encode_key(frame[key])
+        codes_by_key[key], labels_by_key[key] = encoded[key]
+
+    # A dependent key is decoded from its parent's codes. When it comes first
+    # in `keys` it also takes the parent's slot in the packing order, with
+    # the codes re-ranked so they sort by the dependent label.
+    dependent_labels = {}
+    for key in keys:
+        parent = DEPENDENT_KEYS.get(key)
+        if parent not in codes_by_key:
+            continue
+        parent_codes = codes_by_key[parent]
+        first_row = np.zeros(len(labels_by_key[parent]), dtype=np.intp)
+        first_row[parent_codes[::-1]] = np.arange(len(parent_codes) - 1, -1, -1)
+        label_by_parent = frame[key].take(first_row).reset_index(drop=True)
+        if keys.index(parent) < keys.index(key):
+            dependent_labels[key] = label_by_parent.to_numpy()
+            continue
+        order = label_by_parent.sort_values(na_position="last", kind="stable").index.to_numpy()
+        rank = np.empty(len(order), dtype=np.intp)
+        rank[order] = np.arange(len(order))
+        codes_by_key[parent] = rank[parent_codes]
+        labels_by_key[parent] = labels_by_key[parent].take(order)
+        dependent_labels[key] = label_by_parent.take(order).to_numpy()
+
+    pack_order = list(dict.fromkeys(
+        DEPENDENT_KEYS[key] if key in dependent_labels else key
+        for key in keys
+        if key in codes_by_key or key in dependent_labels
+    ))
+    cell = np.zeros(len(frame), dtype=np.int64)
+    span = 1
+    for key in pack_order:
+        cardinality = max(len(labels_by_key[key]), 1)
+        if span * cardinality >= 2**62:
+            # Re-number the cells seen so far (keeping their order) before
+            # the packed id overflows.
+            cell, seen = pd.factorize(cell, sort=True)
+            span = max(len(seen), 1)
+        cell = cell * cardinality + codes_by_key[key]
+        span *= cardinality
+
+    group, cells = pd.factorize(cell, sort=True)
+    n_groups = len(cells)
+
+    first_row = np.zeros(n_groups, dtype=np.intp)
+    first_row[group[::-1]] = np.arange(len(group) - 1, -1, -1)
+
+    result = {}
+    for key in keys:
+        source = DEPENDENT_KEYS[key] if key in dependent_labels else key
+        per_group = codes_by_key[source][first_row]
+        if key in dependent_labels:
+            result[key] = dependent_labels[key][per_group]
+        else:
+            result[key] = labels_by_key[key].take(per_group)
+
+    for measure in measures:
+        column = frame[measure]
+        values = column.to_numpy(dtype=np.float64, na_value=0.0)
+        sums = np.bincount(group, weights=values, minlength=n_groups)
+        result[measure] = sums.astype(np.int64) if pd.api.types.is_integer_dtype(column.dtype) else sums
+
+    return pd.DataFrame(result)
+
+
+class RunningTotal:
+    """
+    Fold per-chunk partial aggregates into a single running groupby sum.
+
+    Partials are buffered and compacted every `compact_every` chunks, so peak
+    memory is bounded by the number of distinct groups rather than by the
+    number of chunks read.
+    """
+
+    def __init__(self, keys: List[str], measures: List[str], compact_every: int = 4):
+        self.keys = keys
+        self.measures = measures
+        self.compact_every = compact_every
+        self.pending: List[pd.DataFrame] = []
+
+    def add(self, partial: pd.DataFrame) -> None:
+        self.pending.append(partial)
+        if len(self.pending) > self.compact_every:
+            self.compact()
+
+    def compact(self) -> None:
+        if len(self.pending) <= 1:
+            return
+        self.pending = [
+            aggregate_packed(pd.concat(self.pending, ignore_index=True), self.keys, self.measures)
+        ]
+
+    def result(self) -> pd.DataFrame:
+        self.compact()
+        if not self.pending:
+            return pd.DataFrame(columns=self.keys + self.measures)
+        return self.pending[0]
+
+
+class ByteRangeReader(io.RawIOBase):
+    """Read-only view of the bytes [start, end) of a file."""
+
+    def __init__(self, path: Path, start: int, end: int):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        data = self._file.read(size)
+        buffer[: len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def partition_source(source: Path, parts: int) -> tuple[List[str], List[tuple[int, int]]]:
+    """
+    Split the body of a CSV file into `parts` byte ranges aligned to line
+    boundaries. Returns the header column names and the (start, end) offsets.
+    Assumes no quoted field spans several lines, which holds for the cleaned
+    MHCLD extract.
+    """
+    size = source.stat().st_size
+    with open(source, "rb") as handle:
+        header = handle.readline()
+        body_start = handle.tell()
+        bounds = [body_start]
+        for i in range(1, parts):
+            offset = max(body_start + (size - body_start) * i // parts, bounds[-1])
+            handle.seek(offset)
+            if offset > body_start:
+                handle.readline()
+            bounds.append(min(handle.tell(), size))
+        bounds.append(size)
+    columns = pd.read_csv(io.BytesIO(header), nrows=0).columns.tolist()
+    ranges = [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+    return columns, ranges
+
+
+def load_cubes(path: Optional[Path] = None) -> Dict[str, dict]:
+    """The default cubes, plus (or replaced by) those defined in a JSON file."""
+    cubes = dict(CUBES)
+    if path is not None:
+        cubes.update(json.loads(path.read_text()))
+    for name, cube in cubes.items():
+        missing = {"keys", "measures"} - set(cube)
+        if missing:
+            raise ValueError(f"Cube '{name}' is missing {sorted(missing)}")
+    return cubes
+
+
+def source_columns(cubes: Dict[str, dict]) -> List[str]:
+    """Columns to read from the cleaned source to build every cube."""
+    needed = set(PREPROCESS_INPUTS)
+    for cube in cubes.values():
+        needed.update(cube["keys"], cube["measures"], cube.get("filter", {}))
+    if PATTERN_COL in needed:
+        needed.update(DIAGNOSIS_COLS)
+    return sorted(needed - DERIVED_COLS)
+
+
+USECOLS: List[str] = source_columns(CUBES)
+
+
+def is_rollup(cube: dict, base: dict) -> bool:
+    """
+    Whether `cube` can be summed out of `base`'s aggregate: its keys and
+    measures are a subset of the base's, the base's filter is part of its own,
+    and any further filter is on a base key.
+    """
+    cube_filter = {col: sorted(values) for col, values in cube.get("filter", {}).items()}
+    base_filter = {col: sorted(values) for col, values in base.get("filter", {}).items()}
+    return (
+        set(cube["keys"]) <= set(base["keys"])
+        and set(cube["measures"]) <= set(base["measures"])
+        and all(cube_filter.get(col) == values for col, values in base_filter.items())
+        and all(col in base["keys"] for col in cube_filter if col not in base_filter)
+    )
+
+
+def plan_cubes(cubes: Dict[str, dict]) -> tuple[List[str], Dict[str, str]]:
+    """
+    Split the cubes into those aggregated from the source rows and roll-ups,
+    each mapped to the smallest source cube it can be derived from.
+    """
+    sources: List[str] = []
+    rollups: Dict[str, str] = {}
+    for name in sorted(cubes, key=lambda name: -len(cubes[name]["keys"])):
+        bases = [base for base in sources if is_rollup(cubes[name], cubes[base])]
+        if bases:
+            rollups[name] = min(bases, key=lambda base: len(cubes[base]["keys"]))
+        else:
+            sources.append(name)
+    return sources, rollups
+
+
+def apply_filter(frame: pd.DataFrame, row_filter: Dict[str, list]) -> pd.DataFrame:
+    """Rows of `frame` whose filter columns hold one of the listed values."""
+    if not row_filter:
+        return frame
+    mask = np.ones(len(frame), dtype=bool)
+    for col, values in row_filter.items():
+        mask &= frame[col].isin(values).to_numpy()
+    return frame[mask]
+
+
+def aggregate_frames(chunks: Iterable[pd.DataFrame], cubes: Dict[str, dict]) -> Dict[str, pd.DataFrame]:
+    """Aggregate every source cube (see plan_cubes) in one pass over `chunks`."""
+    sources, _ = plan_cubes(cubes)
+    totals = {name: RunningTotal(cubes[name]["keys"], cubes[name]["measures"]) for name in sources}
+
+    needs_pattern = any(PATTERN_COL in cubes[name]["keys"] for name in sources)
+    for chunk in chunks:
         chunk = preprocess(chunk)
+        if needs_pattern:
+            chunk[PATTERN_COL] = diagnosis_pattern(chunk)
+        # Unfiltered cubes share one encoding of each key column per chunk.
+        encoded: dict = {}
+        for name, total in totals.items():
+            cube = cubes[name]
+            if cube.get("filter"):
+                total.add(aggregate_packed(apply_filter(chunk, cube["filter"]), cube["keys"], cube["measures"]))
+            else:
+                total.add(aggregate_packed(chunk, cube["keys"], cube["measures"], encoded))
+
+    return {name: total.result() for name, total in totals.items()}
 
-        demo_frames.append(
-            chunk.groupby(DEMO_KEYS, dropna=False)[DIAGNOSIS_COLS + SERVICE_COLS + ["CLIENT_COUNT"]]
-            .sum()
-            .reset_index()
+
+def derive_rollups(results: Dict[str, pd.DataFrame], cubes: Dict[str, dict]) -> Dict[str, pd.DataFrame]:
+    """Add the roll-up cubes to the source cube `results`, in `cubes` order."""
+    _, rollups = plan_cubes(cubes)
+    for name, base in rollups.items():
+        cube = cubes[name]
+        results[name] = aggregate_packed(
+            apply_filter(results[base], cube.get("filter", {})), cube["keys"], cube["measures"]
         )
+    return {name: results[name] for name in cubes}
+
+
+def read_source(
+    source, chunk_size: int, raw: bool = False, usecols: Optional[List[str]] = None, **read_kwargs
+) -> Iterable[pd.DataFrame]:
+    """
+    Stream chunks of the cleaned CSV or partitioned dataset, or clean chunks
+    of the raw PUF on the fly.
+    """
+    if isinstance(source, Path) and source.is_dir():
+        return iter_partitioned_chunks(source, chunk_size, usecols or USECOLS)
+    if raw:
+        return iter_clean_chunks(source, chunk_size, **read_kwargs)
+    # Rows of an unknown state have no code, so read it as a nullable integer.
+    read_kwargs.setdefault("dtype", {"STATEFIP_code": "Int64"})
+    return pd.read_csv(source, chunksize=chunk_size, usecols=usecols or USECOLS, low_memory=False, **read_kwargs)
+
 
-        substance_frames.append(
-            chunk.groupby(SUBSTANCE_KEYS, dropna=False)[DIAGNOSIS_COLS + ["CLIENT_COUNT"]]
-            .sum()
-            .reset_index()
+def aggregate_partition(
+    source: Path,
+    columns: List[str],
+    start: int,
+    end: int,
+    chunk_size: int,
+    cubes: Dict[str, dict],
+    raw: bool = False,
+) -> Dict[str, pd.DataFrame]:
+    stream = io.TextIOWrapper(io.BufferedReader(ByteRangeReader(source, start, end)), encoding="utf-8")
+    with stream:
+        return aggregate_frames(
+            read_source(stream, chunk_size, raw, source_columns(cubes), header=None, names=columns),
+            cubes,
         )
 
-    demo_df = (
-        pd.concat(demo_frames)
-        .groupby(DEMO_KEYS, dropna=False)[DIAGNOSIS_COLS + SERVICE_COLS + ["CLIENT_COUNT"]]
-        .sum()
-        .reset_index()
-    )
 
-    substance_df = (
-        pd.concat(substance_frames)
-        .groupby(SUBSTANCE_KEYS, dropna=False)[DIAGNOSIS_COLS + ["CLIENT_COUNT"]]
-        .sum()
-        .reset_index()
+def aggregate_files(
+    source: Path, files: List[str], chunk_size: int, cubes: Dict[str, dict]
+) -> Dict[str, pd.DataFrame]:
+    return aggregate_frames(
+        iter_partitioned_chunks(source, chunk_size, source_columns(cubes), files=files), cubes
     )
 
-    return demo_df, substance_df
+
+def aggregate_chunks(
+    source: Path,
+    chunk_size: int,
+    workers: int = 1,
+    raw: bool = False,
+    cubes: Optional[Dict[str, dict]] = None,
+) -> Dict[str, pd.DataFrame]:
+    """Build every cube, by output name, from one pass over `source`."""
+    cubes = CUBES if cubes is None else cubes
+    if workers <= 1:
+        results = aggregate_frames(read_source(source, chunk_size, raw, source_columns(cubes)), cubes)
+        return derive_rollups(results, cubes)
+
+    sources, _ = plan_cubes(cubes)
+    totals = {name: RunningTotal(cubes[name]["keys"], cubes[name]["measures"]) for name in sources}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if source.is_dir():
+            files = dataset_files(source)
+            futures = [
+                pool.submit(aggregate_files, source, files[i::workers], chunk_size, cubes)
+                for i in range(min(workers, len(files)))
+            ]
+        else:
+            columns, ranges = partition_source(source, workers)
+            futures = [
+                pool.submit(aggregate_partition, source, columns, start, end, chunk_size, cubes, raw)
+                for start, end in ranges
+            ]
+        for future in futures:
+            for name, part in future.result().items():
+                totals[name].add(part)
+    return derive_rollups({name: total.result() for name, total in totals.items()}, cubes)
+
+
+def report_scaling(
+    source: Path, chunk_size: int, max_workers: int, raw: bool = False, cubes: Optional[Dict[str, dict]] = None
+) -> None:
+    """Print wall-clock time and speedup for increasing worker counts."""
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8}  identical")
+    baseline_seconds = None
+    baseline = None
+    for workers in counts:
+        started = time.perf_counter()
+        result = aggregate_chunks(source, chunk_size, workers, raw, cubes)
+        elapsed = time.perf_counter() - started
+        if baseline is None:
+            baseline, baseline_seconds = result, elapsed
+        identical = all(baseline[name].equals(result[name]) for name in baseline)
+        print(f"{workers:>8} {elapsed:>9.2f} {baseline_seconds / elapsed:>7.2f}x  {identical}")
+
+
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Give an aggregate frame compact, explicit dtypes for columnar storage.
+    Key columns become categoricals (stored as dictionary-encoded columns) and
+    count columns are narrowed to int32 whenever the values fit.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col in MEASURE_COLS:
+            values = df[col].fillna(0)
+            if values.max() <= np.iinfo(np.int32).max:
+                df[col] = values.astype(np.int32)
+            else:
+                df[col] = values.astype(np.int64)
+        elif col == "STATEFIP_code":
+            # The dashboard joins on the code as a string (matching the
+            # TopoJSON ids), so store "1" rather than 1 or 1.0.
+            df[col] = df[col].astype("Int64").astype("string").astype("category")
+        else:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def dimension_dictionary(tables: Dict[str, pd.DataFrame]) -> dict:
+    """
+    Distinct values of every key column across the aggregate tables, in
+    canonical order, with their integer code and, per table, the number of
+    aggregate rows and the CLIENT_COUNT total carrying each value. Tables
+    without a CLIENT_COUNT measure are left out.
+    """
+    tables = {table: df for table, df in tables.items() if "CLIENT_COUNT" in df.columns}
+    stats: Dict[str, Dict[str, dict]] = {}
+    for table, df in tables.items():
+        for col in df.columns:
+            if col in MEASURE_COLS or col in DEPENDENT_KEYS.values():
+                continue
+            labels = df[col].astype(object).where(df[col].notna(), MISSING_LABEL).astype(str)
+            grouped = df["CLIENT_COUNT"].groupby(labels).agg(["size", "sum"])
+            for value, (rows, clients) in grouped.iterrows():
+                entry = stats.setdefault(col, {}).setdefault(value, {"rows": {}, "clients": {}})
+                entry["rows"][table] = int(rows)
+                entry["clients"][table] = int(clients)
+
+    dimensions = {}
+    for col, values in stats.items():
+        order = [value for value in DIMENSION_ORDERS.get(col, []) if value in values]
+        order += sorted(value for value in values if value not in order)
+        dimensions[col] = [{"value": value, "code": code, **values[value]} for code, value in enumerate(order)]
+    return {
+        "tables": {
+            table: {"rows": len(df), "clients": int(df["CLIENT_COUNT"].sum())} for table, df in tables.items()
+        },
+        "dimensions": dimensions,
+    }
+
+
+def write_dimensions(tables: Dict[str, pd.DataFrame], output_dir: Path) -> Path:
+    path = output_dir / DIMENSIONS_FILE
+    path.write_text(json.dumps(dimension_dictionary(tables), indent=1))
+    return path
+
+
+def write_frame(df: pd.DataFrame, output_dir: Path, name: str, fmt: str) -> Path:
+    """
+    Write `df` as data/<name> in `fmt`, removing the other formats of it:
+    the dashboard prefers a .parquet or .arrow file, so one left from an
+    earlier build would shadow the new output.
+    """
+    path = output_dir / f"{name}{OUTPUT_SUFFIXES[fmt]}"
+    for suffix in OUTPUT_SUFFIXES.values():
+        if suffix != path.suffix:
+            (output_dir / f"{name}{suffix}").unlink(missing_ok=True)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        to_columnar(df).to_parquet(path, index=False)
+    else:
+        to_columnar(df).to_feather(path, compression="uncompressed")
+    return path
+
+
+def source_year(source: Path) -> int:
+    """
+    Year of a PUF source: the YEAR column of a partitioned dataset or of the
+    first rows of a CSV (the raw PUF has one), else the four-digit year in
+    its name (MHCLD_PUF_2023_clean.csv).
+    """
+    if source.is_dir():
+        years = dataset_years(source)
+    elif YEAR_COL in pd.read_csv(source, nrows=0).columns:
+        sample = pd.read_csv(source, usecols=[YEAR_COL], nrows=YEAR_SAMPLE_ROWS)[YEAR_COL]
+        years = sorted(int(year) for year in sample.dropna().unique())
+    else:
+        years = []
+    if len(years) > 1:
+        raise ValueError(f"{source} holds more than one year ({years}); pass one source per year")
+    if years:
+        return years[0]
+    match = re.search(r"(?<!\d)(?:19|20)\d{2}(?!\d)", source.name)
+    if match is None:
+        raise ValueError(
+            f"Cannot tell the year of {source}: it has no YEAR column, so pass --year "
+            "or name it after its year, e.g. MHCLD_PUF_2023_clean.csv"
+        )
+    return int(match.group())
+
+
+def content_hash(source: Path) -> str:
+    """SHA-256 of a source file, or of the names and contents of every file under a dataset directory."""
+    digest = hashlib.sha256()
+    files = sorted(path for path in source.rglob("*") if path.is_file()) if source.is_dir() else [source]
+    for path in files:
+        if source.is_dir():
+            digest.update(path.relative_to(source).as_posix().encode())
+        with open(path, "rb") as handle:
+            for block in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def cubes_hash(cubes: Dict[str, dict]) -> str:
+    """
+    Fingerprint of the source cubes of a spec; partials built under another
+    are stale. Roll-ups are derived when merging, so adding one does not
+    invalidate the partials.
+    """
+    sources, _ = plan_cubes(cubes)
+    spec = {name: cubes[name] for name in sources}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def load_manifest(output_dir: Path) -> dict:
+    path = output_dir / MANIFEST_FILE
+    if not path.exists():
+        return {"cubes": None, "years": {}}
+    return json.loads(path.read_text())
+
+
+def with_year(cubes: Dict[str, dict]) -> Dict[str, dict]:
+    """The cube spec of the merged outputs: every cube keyed by YEAR first."""
+    return {name: {**cube, "keys": [YEAR_COL] + cube["keys"]} for name, cube in cubes.items()}
+
+
+def update_partials(args: argparse.Namespace, cubes: Dict[str, dict], manifest: dict) -> None:
+    """
+    Aggregate each --source whose content changed since the manifest was
+    written (or every source with --rebuild) and save its source cubes as
+    that year's partials, updating `manifest` in place.
+    """
+    if args.year is not None and len(args.year) != len(args.source):
+        raise SystemExit(f"--year has {len(args.year)} value(s) for {len(args.source)} --source(s)")
+    years = args.year or [source_year(source) for source in args.source]
+    duplicates = sorted({year for year in years if years.count(year) > 1})
+    if duplicates:
+        raise SystemExit(f"More than one --source for year(s) {duplicates}")
+
+    spec = cubes_hash(cubes)
+    if manifest["cubes"] != spec:
+        stale = sorted(set(manifest["years"]) - {str(year) for year in years})
+        if stale:
+            raise SystemExit(
+                f"The cube spec changed since year(s) {', '.join(stale)} were aggregated; "
+                "pass their sources again to rebuild them"
+            )
+        manifest["years"] = {}
+    manifest["cubes"] = spec
+
+    sources, _ = plan_cubes(cubes)
+    for source, year in zip(args.source, years):
+        digest = content_hash(source)
+        entry = manifest["years"].get(str(year))
+        if entry is not None and entry["sha256"] == digest and not args.rebuild:
+            print(f"Skipped {year}: {source} is unchanged")
+            continue
+
+        started = time.perf_counter()
+        results = aggregate_chunks(source, args.chunk_size, args.workers, args.raw, cubes)
+        partial_dir = args.output_dir / PARTIALS_DIR / str(year)
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        partials = {}
+        for name in sources:
+            path = partial_dir / f"{name}.parquet"
+            results[name].to_parquet(path, index=False)
+            partials[name] = path.relative_to(args.output_dir).as_posix()
+        # An unfiltered CLIENT_COUNT cube sums to the number of source rows.
+        unfiltered = [
+            name for name in sources if "CLIENT_COUNT" in cubes[name]["measures"] and not cubes[name].get("filter")
+        ]
+        manifest["years"][str(year)] = {
+            "source": str(source),
+            "sha256": digest,
+            "rows": int(results[unfiltered[0]]["CLIENT_COUNT"].sum()) if unfiltered else None,
+            "partials": partials,
+        }
+        print(
+            f"Aggregated {len(sources)} cube(s) for {year} from {source} "
+            f"with {args.workers} worker(s) in {time.perf_counter() - started:.1f}s"
+        )
+
+
+def merge_partials(output_dir: Path, manifest: dict, cubes: Dict[str, dict]) -> Dict[str, pd.DataFrame]:
+    """
+    Every cube over all recorded years: the years' partials stacked with a
+    YEAR key (years never share a cell, so nothing needs re-summing), then
+    the roll-ups derived from them.
+    """
+    keyed = with_year(cubes)
+    sources, _ = plan_cubes(cubes)
+    results = {}
+    for name in sources:
+        parts = [
+            pd.read_parquet(output_dir / entry["partials"][name]).assign(**{YEAR_COL: int(year)})
+            for year, entry in sorted(manifest["years"].items())
+        ]
+        results[name] = pd.concat(parts, ignore_index=True)[keyed[name]["keys"] + cubes[name]["measures"]]
+    return derive_rollups(results, keyed)
 
 
 def main() -> None:
@@ -143,16 +929,25 @@ def main() -> None:
     output_dir = args.output_dir
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    demo_df, substance_df = aggregate_chunks(args.source, args.chunk_size)
+    cubes = load_cubes(args.cubes)
+    if args.scaling_report:
+        report_scaling(args.source[0], args.chunk_size, args.workers, args.raw, cubes)
+
+    manifest = load_manifest(output_dir)
+    update_partials(args, cubes, manifest)
+    (output_dir / MANIFEST_FILE).write_text(json.dumps(manifest, indent=1))
 
-    demo_path = output_dir / "demographic_service_stats.csv"
-    substance_path = output_dir / "substance_stats.csv"
+    results = merge_partials(output_dir, manifest, cubes)
+    _, rollups = plan_cubes(cubes)
+    print(f"Merged {len(manifest['years'])} year(s) and rolled up {len(rollups)} cube(s)")
 
-    demo_df.to_csv(demo_path, index=False)
-    substance_df.to_csv(substance_path, index=False)
+    if PATTERN_CUBE in results:
+        results[COMORBIDITY_OUTPUT] = comorbidity_pairs(results.pop(PATTERN_CUBE), [YEAR_COL] + COMORBIDITY_KEYS)
 
-    print(f"Saved demographic/service aggregates to {demo_path}")
-    print(f"Saved substance aggregates to {substance_path}")
+    for name, df in results.items():
+        print(f"Saved {name} ({len(df):,} rows) to {write_frame(df, output_dir, name, args.format)}")
+    dimension_tables = {name: df for name, df in results.items() if name != COMORBIDITY_OUTPUT}
+    print(f"Saved dimension dictionary to {write_dimensions(dimension_tables, output_dir)}")
 
 
 if __name__ == "__main__":
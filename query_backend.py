@@ -0,0 +1,252 @@
+"""
+Query backends behind the dashboard's filter/aggregate layer.
+
+Every view is built from two primitives:
+
+* demographic_counts: sums of measures over the clients matching a filter
+  selection, for several groupings at once;
+* substance_counts: the same over the clients with (or without) a
+  substance-use diagnosis.
+
+PandasBackend answers them from the pre-aggregated files (the count cube, the
+substance x diagnosis cubes, and the bitmap filter index for aggregates built
+before those existed). DuckDBBackend answers them with an embedded DuckDB
+engine over the cleaned record-level data stored as Parquet (a single file or
+clean_data.py's partitioned dataset), so combinations precompute_stats.py did
+not anticipate need no rebuild. DuckDB reads only the referenced columns and
+pushes the filters into the Parquet scan, skipping row groups whose
+statistics cannot match and, for a partitioned dataset, whole partitions.
+
+Both return the same labels: missing demographic values appear as
+"Missing", STATEFIP_code as a string, SUB_dia as "YES"/"NO" and SAP as
+"1.0"/"0.0"/"missing", as written by precompute_stats.py.
+"""
+
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List, Mapping, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from clean_data import read_dictionary
+from data_cube import DataCube
+from filter_index import FilterIndex
+
+MISSING_LABEL = "Missing"
+# Demographic columns whose missing values are labelled MISSING_LABEL.
+MISSING_FILLED = ["RACE", "SEX", "EMPLOY", "LIVARAG"]
+
+
+class QueryBackend(ABC):
+    """Interface of the dashboard's aggregate queries."""
+
+    @abstractmethod
+    def demographic_counts(
+        self, selection: Mapping[str, Sequence], groupings: Sequence[Sequence[str]], measures: Sequence[str]
+    ) -> List[pd.DataFrame]:
+        """
+        For each grouping (a list of columns, possibly empty), a frame of the
+        grouping columns followed by the summed `measures` over the clients
+        matching `selection`.
+        """
+
+    @abstractmethod
+    def substance_counts(
+        self, selection: Mapping[str, Sequence], dia: str, by: Sequence[str], measures: Sequence[str]
+    ) -> pd.DataFrame:
+        """
+        Summed `measures` per `by` over the clients matching `selection` whose
+        substance-use diagnosis flag (SUB_dia) is `dia`; empty when none match.
+        """
+
+
+class PandasBackend(QueryBackend):
+    """Queries over the pre-aggregated demographic cube and substance table."""
+
+    def __init__(
+        self,
+        cube: DataCube,
+        substance: pd.DataFrame,
+        substance_index: FilterIndex,
+        substance_cubes: Optional[Mapping[str, DataCube]] = None,
+    ):
+        """
+        `substance_cubes` maps a SUB_dia value to a cube of the clients with
+        it, by demographic cell and SUB or SAP, with CLIENT_COUNT among its
+        measures; queries they cover are a slice and sum of the cube.
+        """
+        self.cube = cube
+        self.substance = substance
+        self.substance_index = substance_index
+        self.substance_cubes = substance_cubes or {}
+
+    def axes_for(self, columns: Sequence[str]) -> List[str]:
+        return [name for name, labels in self.cube.axes.items() if set(labels.columns) & set(columns)]
+
+    def demographic_counts(self, selection, groupings, measures):
+        cube = self.cube.select(selection)
+        # Groupings that leave out the state axis share one sum over it.
+        collapsed = cube.collapse(["STATE"]) if "STATE" in cube.axes else cube
+        results = []
+        for columns in groupings:
+            axes = self.axes_for(columns)
+            source = collapsed if all(axis in collapsed.axes for axis in axes) else cube
+            if axes:
+                frame = source.reduce(axes, measures)
+            else:
+                frame = source.totals()[list(measures)].to_frame().T.reset_index(drop=True)
+            results.append(frame[list(columns) + list(measures)])
+        return results
+
+    def substance_counts(self, selection, dia, by, measures):
+        cube = self.substance_cubes.get(dia)
+        if cube is not None and set(by) <= set(cube.axes) and set(measures) <= set(cube.measures):
+            sums = cube.select(selection).reduce(list(by), list(dict.fromkeys([*measures, "CLIENT_COUNT"])))
+            # Groups without clients are absent from the row-level answer too.
+            sums = sums[sums["CLIENT_COUNT"].to_numpy() > 0]
+            return sums[list(by) + list(measures)].reset_index(drop=True)
+        rows = self.substance_index.take(self.substance, selection)
+        rows = rows[rows["SUB_dia"] == dia].dropna(subset=list(by))
+        return rows.groupby(list(by), observed=True)[list(measures)].sum().reset_index()
+
+
+class DuckDBBackend(QueryBackend):
+    """
+    Queries over record-level Parquet (as written by `clean_data.py --output
+    *.parquet`, or a partitioned dataset directory) with an embedded DuckDB
+    connection. `duckdb` is imported only when this backend is used.
+    """
+
+    # Columns derived from the record columns. Everything else is grouped on
+    # the raw column and relabelled on the (small) result, which keeps string
+    # casts out of the hash aggregation.
+    EXPRESSIONS = {
+        "SUB_dia": "CASE WHEN SUB IS NULL THEN 'NO' ELSE 'YES' END",
+    }
+
+    def __init__(self, records: Path):
+        import duckdb
+
+        records = Path(records)
+        if records.is_dir():
+            # Label columns are stored as codes; translate through the dictionary.
+            self.categories = read_dictionary(records)["columns"]
+            self.records = str(records / "**" / "*.parquet")
+        else:
+            self.categories = {}
+            self.records = str(records)
+        self.connection = duckdb.connect()
+        self.columns = set(
+            self.connection.execute(
+                "SELECT * FROM read_parquet(?, hive_partitioning = true) LIMIT 0", [self.records]
+            ).df().columns
+        )
+        # A DuckDB connection is not safe to share between threads; each
+        # Streamlit session thread queries through its own cursor.
+        self.local = threading.local()
+
+    def cursor(self):
+        if not hasattr(self.local, "cursor"):
+            self.local.cursor = self.connection.cursor()
+        return self.local.cursor
+
+    def column(self, name: str) -> str:
+        return self.EXPRESSIONS.get(name, f'"{name}"')
+
+    def measure(self, name: str) -> str:
+        if name == "CLIENT_COUNT":
+            return "COUNT(*) AS CLIENT_COUNT"
+        return f'COALESCE(SUM(CAST("{name}" AS BIGINT)), 0) AS "{name}"'
+
+    def where(self, selection: Mapping[str, Sequence], extra: Sequence[str] = ()) -> tuple[str, list]:
+        """WHERE clause on the raw columns, so DuckDB can push it into the Parquet scan."""
+        clauses = list(extra)
+        params: list = []
+        for col, values in selection.items():
+            if col not in self.columns:
+                # Records written before the column existed (e.g. YEAR in a
+                # single-year file) hold one value of it: nothing to filter.
+                continue
+            values = list(values)
+            present = [value for value in values if value != MISSING_LABEL or col not in MISSING_FILLED]
+            if col in self.categories:
+                codes = {label: code for code, label in enumerate(self.categories[col])}
+                missing = len(present) < len(values)
+                present = [codes[value] for value in present if value in codes]
+                values = present + [MISSING_LABEL] * missing
+            terms = []
+            if present:
+                terms.append(f'"{col}" IN ({", ".join("?" * len(present))})')
+                params.extend(present)
+            if len(present) < len(values):
+                terms.append(f'"{col}" IS NULL')
+            clauses.append(f"({' OR '.join(terms)})" if terms else "FALSE")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def labelled(self, frame: pd.DataFrame, columns: Sequence[str], measures: Sequence[str]) -> pd.DataFrame:
+        for col in columns:
+            if col in self.categories:
+                codes = frame[col].fillna(-1).to_numpy(dtype=np.int16)
+                frame[col] = pd.Categorical.from_codes(codes, categories=self.categories[col]).astype(object)
+            if col in MISSING_FILLED:
+                frame[col] = frame[col].fillna(MISSING_LABEL)
+            elif col == "STATEFIP_code":
+                codes = frame[col].astype("Int64")
+                frame[col] = codes.astype(str).where(codes.notna())
+            elif col == "SAP":
+                frame[col] = frame[col].map(lambda value: "missing" if pd.isna(value) else str(float(value)))
+        for measure in measures:
+            frame[measure] = frame[measure].astype(np.int64)
+        if columns:
+            frame = frame.sort_values(list(columns), na_position="last", kind="stable")
+        return frame.reset_index(drop=True)
+
+    def demographic_counts(self, selection, groupings, measures):
+        grouped: List[str] = []
+        for columns in groupings:
+            grouped.extend(col for col in columns if col not in grouped)
+        where, params = self.where(selection)
+        sets = ", ".join(
+            "(" + ", ".join(self.column(col) for col in columns) + ")" for columns in groupings
+        )
+        # GROUPING() has one bit per grouped column (most significant first),
+        # set when the row is aggregated over that column.
+        select = [f'{self.column(col)} AS "{col}"' for col in grouped]
+        if grouped:
+            select.append(f"GROUPING({', '.join(self.column(col) for col in grouped)}) AS _grouping")
+        query = (
+            f"SELECT {', '.join(select + [self.measure(m) for m in measures])} "
+            f"FROM read_parquet(?, hive_partitioning = true){where} GROUP BY GROUPING SETS ({sets})"
+        )
+        result = self.cursor().execute(query, [self.records] + params).df()
+
+        frames = []
+        for columns in groupings:
+            if grouped:
+                mask = sum(1 << (len(grouped) - 1 - i) for i, col in enumerate(grouped) if col not in columns)
+                frame = result[result["_grouping"] == mask]
+            else:
+                frame = result
+            frame = frame[list(columns) + list(measures)].copy()
+            if not columns and frame.empty:
+                frame = pd.DataFrame([[0] * len(measures)], columns=list(measures))
+            frames.append(self.labelled(frame, columns, measures))
+        return frames
+
+    def substance_counts(self, selection, dia, by, measures):
+        dia_clause = "SUB IS NOT NULL" if dia == "YES" else "SUB IS NULL"
+        where, params = self.where(selection, [dia_clause])
+        keys = ", ".join(f'{self.column(col)} AS "{col}"' for col in by)
+        query = (
+            f"SELECT {keys}, {', '.join(self.measure(m) for m in measures)} "
+            f"FROM read_parquet(?, hive_partitioning = true){where} GROUP BY ALL"
+        )
+        result = self.cursor().execute(query, [self.records] + params).df()
+        # SAP is the one key whose missing values are a label of their own.
+        result = result.dropna(subset=[col for col in by if col != "SAP"])
+        return self.labelled(result, by, measures)
+
@@ -0,0 +1,66 @@
+"""
+Read-only aggregate frames shared by every Streamlit session of a process.
+
+st.cache_data pickles its result and gives each rerun a fresh copy, so with
+many sessions the aggregates were held (and deserialized) once per rerun.
+A SharedDataset is created once per process (held with st.cache_resource)
+and holds the frames on the heap once; it hands out frames that reference
+those buffers without copying them.
+
+No view can mutate the shared data. Under pandas Copy-on-Write (always on
+from pandas 3; codes.py opts in on older versions) `frame()` returns a
+shallow copy, and any write to it (or to anything derived from it) copies
+the touched column first; arrays reached through `to_numpy()` are read-only
+views. Without Copy-on-Write `frame()` returns a deep copy instead.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+PANDAS_MAJOR = int(pd.__version__.split(".")[0])
+
+
+def copy_on_write() -> bool:
+    """Whether pandas copies a shared column before writing to it."""
+    return PANDAS_MAJOR >= 3 or pd.get_option("mode.copy_on_write") is True
+
+
+class SharedDataset:
+    """Named aggregate frames plus the filter options derived from them."""
+
+    def __init__(self, frames: Dict[str, pd.DataFrame], loaded_bytes: Optional[Dict[str, int]] = None):
+        """`loaded_bytes` is the size of each frame as read, before any dtype conversion."""
+        self._frames = frames
+        self._options: Dict[str, List[str]] = {}
+        self._loaded_bytes = loaded_bytes or {}
+
+    def frame(self, name: str) -> pd.DataFrame:
+        """A copy-on-write view of the named frame (a deep copy without Copy-on-Write)."""
+        return self._frames[name].copy(deep=not copy_on_write())
+
+    def options(self, column: str) -> List[str]:
+        """
+        Sorted distinct non-null values of `column` across all frames,
+        computed on first use (the dimension dictionary usually answers this).
+        """
+        if column not in self._options:
+            values = set()
+            for df in self._frames.values():
+                if column in df.columns:
+                    values.update(df[column].dropna().unique())
+            self._options[column] = sorted(values)
+        return list(self._options[column])
+
+    def memory_report(self) -> pd.DataFrame:
+        """Bytes per frame as read (loaded_bytes) and as held (bytes)."""
+        held = {name: int(df.memory_usage(deep=True).sum()) for name, df in self._frames.items()}
+        return pd.DataFrame(
+            {
+                "frame": list(held),
+                "loaded_bytes": [self._loaded_bytes.get(name, held[name]) for name in held],
+                "bytes": list(held.values()),
+            }
+        )
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Build the bundled, simplified US state geometry used by the dashboard maps.
+
+The dashboard used to make every browser download the county-resolution
+us-10m TopoJSON from a CDN. This script turns a state-level TopoJSON into a
+small asset that ships with the app (static/us_states.topo.json, served by
+Streamlit's static file serving):
+
+* only the state polygons are kept, as a `states` object whose ids are the
+  STATEFIP_code strings written by precompute_stats.py, so the map layers
+  join on them without any conversion;
+* every arc is simplified with Douglas-Peucker (tolerance in degrees).
+  Arcs are shared by neighbouring states, so simplifying each arc once keeps
+  the borders seamless;
+* rings that end up degenerate, tinier than --min-area, or wound the other
+  way from their source ring are dropped. d3-geo reads a ring's winding to
+  tell its inside, so a flipped island would fill the rest of the map.
+
+The bundled asset was built from bqplot's USStatesMap.json (Apache-2.0,
+derived from the public-domain US Census cartographic boundaries):
+
+    python simplify_states.py --source USStatesMap.json --object subunits
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / "static" / "us_states.topo.json"
+
+
+def decode_arc(arc: List[List[int]]) -> np.ndarray:
+    """Absolute quantized positions of a delta-encoded arc."""
+    return np.cumsum(np.asarray(arc, dtype=np.int64).reshape(-1, 2), axis=0)
+
+
+def encode_arc(points: np.ndarray) -> List[List[int]]:
+    """Delta-encode absolute quantized positions."""
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return deltas.tolist()
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Indices of the points kept when simplifying a polyline."""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+    return np.flatnonzero(keep)
+
+
+def simplify_arc(points: np.ndarray, tolerance: float, scale: np.ndarray) -> np.ndarray:
+    """
+    Simplify one arc, keeping its endpoints (shared with neighbouring arcs).
+    Distances are measured in degrees (`scale` is the topology's quantization
+    step per axis). A closed arc (an island) is split at its farthest point
+    from the start so it keeps enough vertices to stay a ring.
+    """
+    if len(points) <= 3:
+        return points
+    coords = points * scale
+    if np.array_equal(points[0], points[-1]):
+        split = int(np.argmax(np.hypot(*(coords - coords[0]).T)))
+        first = douglas_peucker(coords[:split + 1], tolerance)
+        second = douglas_peucker(coords[split:], tolerance) + split
+        keep = np.concatenate([first, second[1:]])
+        if len(keep) < 4:
+            keep = np.unique(np.linspace(0, len(points) - 1, 4).astype(int))
+        return points[keep]
+    return points[douglas_peucker(coords, tolerance)]
+
+
+def arc_indices(arcs) -> List[int]:
+    """Every arc index referenced by a (possibly nested) geometry arc list."""
+    if isinstance(arcs, int):
+        return [arcs]
+    return [index for part in arcs for index in arc_indices(part)]
+
+
+def remap_arcs(arcs, mapping: Dict[int, int]):
+    """Rewrite arc references (including reversed ~i references) through `mapping`."""
+    if isinstance(arcs, int):
+        return mapping[arcs] if arcs >= 0 else ~mapping[~arcs]
+    return [remap_arcs(part, mapping) for part in arcs]
+
+
+def ring_coords(ring: List[int], arcs: Dict[int, np.ndarray], scale: np.ndarray) -> np.ndarray:
+    """Positions (in degrees, relative to the transform) of a ring of arc references."""
+    parts = [arcs[index] if index >= 0 else arcs[~index][::-1] for index in ring]
+    return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]]) * scale
+
+
+def ring_area(coords: np.ndarray) -> float:
+    """Signed shoelace area of a closed ring (negative when clockwise)."""
+    x, y = coords[:, 0], coords[:, 1]
+    return float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2
+
+
+def prune_polygons(
+    polygons: List[List[List[int]]],
+    arcs: Dict[int, np.ndarray],
+    source_arcs: Dict[int, np.ndarray],
+    scale: np.ndarray,
+    min_area: float,
+) -> List[List[List[int]]]:
+    """
+    Drop rings that simplification left degenerate (fewer than 4 positions),
+    smaller than `min_area` square degrees, or wound the other way from the
+    same ring in `source_arcs`; a polygon goes with its outer ring.
+    """
+    def keep(ring: List[int]) -> bool:
+        coords = ring_coords(ring, arcs, scale)
+        if len(coords) < 4:
+            return False
+        area = ring_area(coords)
+        source_area = ring_area(ring_coords(ring, source_arcs, scale))
+        return abs(area) >= min_area and np.sign(area) == np.sign(source_area)
+
+    return [
+        [outer] + [hole for hole in holes if keep(hole)]
+        for outer, *holes in polygons
+        if keep(outer)
+    ]
+
+
+def simplify_states(topology: dict, object_name: str, tolerance: float, min_area: float) -> dict:
+    """Return a TopoJSON topology holding only the simplified `states` object."""
+    geometries = []
+    for geometry in topology["objects"][object_name]["geometries"]:
+        if geometry.get("type") is None or geometry.get("id") is None:
+            continue
+        properties = geometry.get("properties") or {}
+        geometries.append(
+            {
+                "type": geometry["type"],
+                "id": str(int(geometry["id"])),
+                "properties": {"name": properties.get("name")},
+                "arcs": geometry["arcs"],
+            }
+        )
+
+    scale = np.asarray(topology["transform"]["scale"])
+    referenced = {index if index >= 0 else ~index for g in geometries for index in arc_indices(g["arcs"])}
+    source_arcs = {old: decode_arc(topology["arcs"][old]) for old in referenced}
+    simplified = {old: simplify_arc(points, tolerance, scale) for old, points in source_arcs.items()}
+    for geometry in geometries:
+        polygons = geometry["arcs"] if geometry["type"] == "MultiPolygon" else [geometry["arcs"]]
+        polygons = prune_polygons(polygons, simplified, source_arcs, scale, min_area)
+        geometry["type"], geometry["arcs"] = ("Polygon", polygons[0]) if len(polygons) == 1 else ("MultiPolygon", polygons)
+
+    used = sorted({index if index >= 0 else ~index for g in geometries for index in arc_indices(g["arcs"])})
+    mapping = {old: new for new, old in enumerate(used)}
+    arcs = [encode_arc(simplified[old]) for old in used]
+    for geometry in geometries:
+        geometry["arcs"] = remap_arcs(geometry["arcs"], mapping)
+
+    return {
+        "type": "Topology",
+        "transform": topology["transform"],
+        "objects": {"states": {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": arcs,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the simplified US state TopoJSON used by the maps.")
+    parser.add_argument(
+        "--source",
+        required=True,
+        type=Path,
+        help="State-level TopoJSON whose geometry ids are numeric FIPS codes.",
+    )
+    parser.add_argument(
+        "--object",
+        default="states",
+        help="Name of the state GeometryCollection in the source topology.",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=DEFAULT_OUTPUT,
+        help="Path of the simplified TopoJSON to write.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="Douglas-Peucker tolerance, in degrees.",
+    )
+    parser.add_argument(
+        "--min-area",
+        type=float,
+        default=0.002,
+        help="Rings (islands, lakes) smaller than this many square degrees are dropped.",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    topology = json.loads(args.source.read_text())
+    simplified = simplify_states(topology, args.object, args.tolerance, args.min_area)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(simplified, separators=(",", ":")))
+
+    before = sum(len(arc) for arc in topology["arcs"])
+    after = sum(len(arc) for arc in simplified["arcs"])
+    print(
+        f"Saved {len(simplified['objects']['states']['geometries'])} states to {args.output} "
+        f"({after:,} of {before:,} arc positions, {args.output.stat().st_size / 1024:.0f} KiB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Checks of association.py against 2x2 tables worked out by hand. Run with
+`python -m pytest test_association.py`.
+"""
+
+import numpy as np
+import pytest
+
+from association import association_frame, association_metrics
+
+
+def metrics_of(a: int, group: int, outcome: int, n: int) -> dict:
+    """Metrics of group 0 in a two-group table: a of its `group` members have the outcome."""
+    counts = np.array([[a], [outcome - a]])
+    totals = np.array([group, n - group])
+    return {name: values[0, 0] for name, values in association_metrics(counts, totals).items()}
+
+
+def test_metrics_of_a_table_without_zero_cells():
+    # a=20, b=30, c=30, d=120, n=200.
+    metrics = metrics_of(a=20, group=50, outcome=50, n=200)
+    assert metrics["conditional"] == pytest.approx(0.4)
+    # Wilson: (a + z²/2) / (n + z²) ± z·sqrt(a·b/n + z²/4) / (n + z²).
+    assert metrics["conditional_low"] == pytest.approx(0.276083897, rel=1e-8)
+    assert metrics["conditional_high"] == pytest.approx(0.538185623, rel=1e-8)
+    assert metrics["lift"] == pytest.approx(0.4 / 0.25)
+    # ad / bc = 2400 / 900; Woolf: exp(log OR ± z·sqrt(1/a + 1/b + 1/c + 1/d)).
+    assert metrics["odds_ratio"] == pytest.approx(8 / 3)
+    assert metrics["odds_ratio_low"] == pytest.approx(1.333593717, rel=1e-8)
+    assert metrics["odds_ratio_high"] == pytest.approx(5.332292004, rel=1e-8)
+    # n(ad - bc)² / (50·150·50·150) = 8, p = erfc(sqrt(8 / 2)).
+    assert metrics["chi_square"] == pytest.approx(8.0)
+    assert metrics["p_value"] == pytest.approx(0.004677734981, rel=1e-8)
+
+
+def test_metrics_of_a_table_with_a_zero_cell():
+    # a=0, b=10, c=30, d=60, n=100.
+    metrics = metrics_of(a=0, group=10, outcome=30, n=100)
+    assert metrics["conditional"] == 0
+    assert metrics["conditional_low"] == 0
+    # z² / (n + z²) when a = 0.
+    assert metrics["conditional_high"] == pytest.approx(0.277532800, rel=1e-8)
+    # 0.5 is added to every cell (Haldane-Anscombe): 0.5·60.5 / (10.5·30.5).
+    # statsmodels' Table2x2 shifts only the zero cell, which gives 0.1.
+    assert metrics["odds_ratio"] == pytest.approx(0.094457455, rel=1e-8)
+    assert metrics["odds_ratio_low"] == pytest.approx(0.005354409, rel=1e-6)
+    assert metrics["odds_ratio_high"] == pytest.approx(1.666329693, rel=1e-8)
+    # The chi-square uses the uncorrected cells: 100·300² / (10·90·30·70).
+    assert metrics["chi_square"] == pytest.approx(100 / 21)
+    assert metrics["p_value"] == pytest.approx(0.029096331741, rel=1e-8)
+
+
+def test_empty_margins_give_no_chi_square():
+    counts = np.array([[0, 5], [0, 5]])
+    metrics = association_metrics(counts, np.array([10, 10]))
+    assert metrics["chi_square"][:, 0].tolist() == [0.0, 0.0]
+    assert metrics["p_value"][:, 0].tolist() == [1.0, 1.0]
+
+
+def test_association_frame_keeps_the_selected_pairs():
+    metrics = {"count": np.array([[1, 0], [2, 3]]), "total": np.array([[1], [5]])}
+    frame = association_frame(metrics, ["x", "y"], ["p", "q"], "group", "outcome", keep=metrics["count"] > 0)
+    assert frame.to_dict("list") == {
+        "group": ["x", "y", "y"],
+        "outcome": ["p", "p", "q"],
+        "count": [1, 2, 3],
+        "total": [1, 5, 5],
+    }
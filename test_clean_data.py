@@ -0,0 +1,17 @@
+"""
+Checks of the raw PUF recodes in clean_data.py. Run with
+`python -m pytest test_clean_data.py`.
+"""
+
+import pandas as pd
+
+from clean_data import RAW_COLUMNS, clean_chunk
+
+
+def test_unknown_state_is_missing_in_both_state_columns():
+    raw = pd.DataFrame({col: [1, 1] for col in RAW_COLUMNS})
+    raw["STATEFIP"] = [6, -9]
+    cleaned = clean_chunk(raw)
+    assert cleaned["STATEFIP"].isna().tolist() == [False, True]
+    assert cleaned["STATEFIP_code"].isna().tolist() == [False, True]
+    assert cleaned["STATEFIP_code"].iloc[0] == 6
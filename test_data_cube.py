@@ -0,0 +1,72 @@
+"""
+Checks of DataCube slices and sums against pandas filtering and groupby.
+Run with `python -m pytest test_data_cube.py`.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_cube import DataCube
+
+STATES = {"1": "Alabama", "10": "Delaware", "2": "Alaska", "6": "California"}
+AXES = {"AGE": ["AGE"], "SEX": ["SEX"], "STATE": ["STATEFIP", "STATEFIP_code"]}
+MEASURES = ["DEPRESSFLG", "CLIENT_COUNT"]
+
+
+def aggregate_frame(seed: int = 5) -> pd.DataFrame:
+    """A long aggregate with a missing SEX label and state name and code sharing one axis."""
+    rng = np.random.default_rng(seed)
+    rows = 3000
+    codes = rng.choice(list(STATES), rows)
+    frame = pd.DataFrame(
+        {
+            "AGE": rng.choice(["Under 15", "15-24", "25-34"], rows),
+            "SEX": rng.choice(["Female", "Male", None], rows),
+            "STATEFIP": [STATES[code] for code in codes],
+            "STATEFIP_code": codes,
+            "DEPRESSFLG": rng.integers(0, 5, rows),
+            "CLIENT_COUNT": rng.integers(1, 9, rows),
+        }
+    )
+    return frame.groupby(["AGE", "SEX", "STATEFIP", "STATEFIP_code"], dropna=False).sum().reset_index()
+
+
+@pytest.mark.parametrize(
+    "selection, keep",
+    [
+        ({}, ["AGE"]),
+        ({"AGE": ["15-24", "25-34"]}, ["STATE"]),
+        ({"SEX": ["Female"], "STATEFIP_code": ["2", "10"]}, ["AGE", "STATE"]),
+        ({"AGE": ["Under 15"], "SEX": ["Male"]}, []),
+    ],
+)
+def test_select_and_reduce_match_groupby(selection, keep):
+    frame = aggregate_frame()
+    cube = DataCube.from_frame(frame, AXES, MEASURES)
+
+    result = cube.select(selection).reduce(keep)
+    result = result[result["CLIENT_COUNT"] > 0].reset_index(drop=True)
+
+    rows = np.ones(len(frame), dtype=bool)
+    for column, values in selection.items():
+        rows &= frame[column].isin(values).to_numpy()
+    columns = [column for name in keep for column in AXES[name]]
+    if columns:
+        expected = frame[rows].groupby(columns, dropna=False)[MEASURES].sum().reset_index()
+    else:
+        expected = frame.loc[rows, MEASURES].sum().to_frame().T
+
+    pd.testing.assert_frame_equal(
+        result.astype(object), expected.astype(object).reset_index(drop=True), check_dtype=False
+    )
+
+
+def test_collapse_and_totals_match_the_frame_sums():
+    frame = aggregate_frame()
+    cube = DataCube.from_frame(frame, AXES, MEASURES)
+    expected = frame.groupby("AGE")[MEASURES].sum().reset_index()
+    pd.testing.assert_frame_equal(
+        cube.collapse(["SEX", "STATE"]).reduce(["AGE"]).astype(object), expected.astype(object), check_dtype=False
+    )
+    assert cube.totals().tolist() == frame[MEASURES].sum().tolist()
@@ -0,0 +1,45 @@
+"""
+Checks of FilterIndex masks against a chain of `isin` masks. Run with
+`python -m pytest test_filter_index.py`.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from filter_index import FilterIndex
+
+
+def demographic_frame(rows: int, seed: int = 2) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "AGE": pd.Categorical(rng.choice(["Under 15", "15-24", "25-34"], rows)),
+            "SEX": rng.choice(["Female", "Male", "Missing"], rows),
+            "RACE": rng.choice(["Asian", "White", "Missing"], rows),
+            "EMPLOY": rng.choice(["Full-time", "Unemployed"], rows),
+            "LIVARAG": rng.choice(["Other", "Private residence"], rows),
+        }
+    )
+
+
+@pytest.mark.parametrize("rows", [1, 8, 1003])
+@pytest.mark.parametrize(
+    "selection",
+    [
+        {},
+        {"AGE": ["15-24"]},
+        {"SEX": ["Female", "Missing"], "RACE": ["White"]},
+        {"AGE": ["Under 15", "25-34"], "EMPLOY": ["Unemployed"], "LIVARAG": ["Other"]},
+        {"SEX": []},
+        {"RACE": ["Not a label"]},
+    ],
+)
+def test_mask_matches_isin_chain(rows, selection):
+    frame = demographic_frame(rows)
+    expected = np.ones(rows, dtype=bool)
+    for column, values in selection.items():
+        expected &= frame[column].isin(values).to_numpy()
+    index = FilterIndex(frame)
+    np.testing.assert_array_equal(index.mask(selection), expected)
+    pd.testing.assert_frame_equal(index.take(frame, selection), frame[expected])
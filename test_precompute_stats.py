@@ -0,0 +1,151 @@
+"""
+Checks of the packed aggregation in precompute_stats.py against a plain
+pandas groupby, of the comorbidity pairs against X^T X, and of how it tells
+a source's year. Run with `python -m pytest test_precompute_stats.py`.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from precompute_stats import (
+    DIAGNOSIS_COLS,
+    PATTERN_COL,
+    RunningTotal,
+    aggregate_packed,
+    comorbidity_pairs,
+    diagnosis_pattern,
+    source_year,
+)
+
+# State names sort in a different order from their codes' strings.
+STATES = {"1": "Alabama", "10": "Delaware", "2": "Alaska", "56": "Wyoming", "6": "California"}
+
+
+def random_frame(rows: int, seed: int) -> pd.DataFrame:
+    """Keys with missing values, a categorical key, a dependent state name, and flags holding -9 and NaN."""
+    rng = np.random.default_rng(seed)
+    codes = rng.choice(list(STATES), rows)
+    frame = pd.DataFrame(
+        {
+            "AGE": rng.choice(["Under 15", "15-24", "25-34", None], rows),
+            "SEX": pd.Categorical(rng.choice(["Female", "Male", None], rows), categories=["Female", "Male"]),
+            "SUB": rng.choice(["Alcohol", "Opioid", "Cannabis", None], rows),
+            "STATEFIP": [STATES[code] for code in codes],
+            "STATEFIP_code": codes,
+            "DEPRESSFLG": rng.choice([0, 1, -9], rows),
+            "ADHDFLG": rng.choice([0.0, 1.0, np.nan], rows),
+            "CLIENT_COUNT": np.ones(rows, dtype=np.int64),
+        }
+    )
+    return frame
+
+
+def reference(frame: pd.DataFrame, keys: list, measures: list) -> pd.DataFrame:
+    return frame.groupby(keys, dropna=False, observed=True)[measures].sum().reset_index()
+
+
+def assert_same_values(result: pd.DataFrame, expected: pd.DataFrame) -> None:
+    # Only the values are compared: measure dtypes (int vs float) may differ.
+    pd.testing.assert_frame_equal(
+        result.astype(object).reset_index(drop=True),
+        expected.astype(object).reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+MEASURES = ["DEPRESSFLG", "ADHDFLG", "CLIENT_COUNT"]
+
+
+@pytest.mark.parametrize(
+    "keys",
+    [
+        ["AGE", "SEX"],
+        ["SUB"],
+        ["AGE", "STATEFIP", "STATEFIP_code"],
+        ["STATEFIP_code", "SEX", "STATEFIP"],
+    ],
+)
+def test_aggregate_packed_matches_groupby(keys):
+    frame = random_frame(5000, seed=len(keys))
+    assert_same_values(aggregate_packed(frame, keys, MEASURES), reference(frame, keys, MEASURES))
+
+
+def test_running_total_compaction_matches_groupby():
+    keys = ["AGE", "SEX", "SUB", "STATEFIP", "STATEFIP_code"]
+    frame = random_frame(6000, seed=7)
+    total = RunningTotal(keys, MEASURES, compact_every=2)
+    for start in range(0, len(frame), 700):
+        total.add(aggregate_packed(frame.iloc[start:start + 700], keys, MEASURES))
+    assert_same_values(total.result(), reference(frame, keys, MEASURES))
+
+
+def test_aggregate_packed_renumbers_before_overflow():
+    # Seven keys of ~1000 labels each span more than 2**62 packed cells.
+    rng = np.random.default_rng(3)
+    keys = [f"K{i}" for i in range(7)]
+    frame = pd.DataFrame({key: rng.integers(0, 1000, 3000).astype(str) for key in keys})
+    frame.loc[::50, "K3"] = None
+    frame["CLIENT_COUNT"] = 1
+    frame = pd.concat([frame, frame.iloc[:500]], ignore_index=True)
+    assert_same_values(
+        aggregate_packed(frame, keys, ["CLIENT_COUNT"]), reference(frame, keys, ["CLIENT_COUNT"])
+    )
+
+
+def test_comorbidity_pairs_match_per_cell_gram_matrices():
+    rng = np.random.default_rng(11)
+    rows = 4000
+    keys = ["AGE", "SEX"]
+    records = pd.DataFrame(
+        {
+            "AGE": rng.choice(["Under 15", "15-24", "25-34", None], rows),
+            "SEX": rng.choice(["Female", "Male", None], rows),
+        }
+    )
+    for col in DIAGNOSIS_COLS:
+        records[col] = rng.choice([0.0, 1.0, np.nan], rows, p=[0.6, 0.3, 0.1])
+    records[PATTERN_COL] = diagnosis_pattern(records)
+    records["CLIENT_COUNT"] = 1
+    patterns = records.groupby(keys + [PATTERN_COL], dropna=False)["CLIENT_COUNT"].sum().reset_index()
+
+    pairs = comorbidity_pairs(patterns, keys)
+
+    first, second = np.triu_indices(len(DIAGNOSIS_COLS))
+    expected = []
+    for cell, group in records.groupby(keys, dropna=False):
+        flags = (group[DIAGNOSIS_COLS].fillna(0).to_numpy() > 0).astype(np.int64)
+        gram = flags.T @ flags
+        for a, b in zip(first, second):
+            if gram[a, b]:
+                expected.append((*cell, DIAGNOSIS_COLS[a], DIAGNOSIS_COLS[b], gram[a, b]))
+    expected = pd.DataFrame(expected, columns=keys + ["DIAG_A", "DIAG_B", "CLIENT_COUNT"])
+
+    columns = keys + ["DIAG_A", "DIAG_B"]
+    assert_same_values(
+        pairs.sort_values(columns, na_position="last").reset_index(drop=True),
+        expected.sort_values(columns, na_position="last").reset_index(drop=True),
+    )
+
+
+def test_source_year_reads_the_year_column(tmp_path):
+    source = tmp_path / "puf_extract.csv"
+    pd.DataFrame({"YEAR": [2024, 2024], "AGE": [1, 2]}).to_csv(source, index=False)
+    assert source_year(source) == 2024
+
+
+def test_source_year_falls_back_to_the_file_name(tmp_path):
+    source = tmp_path / "MHCLD_PUF_2023_clean.csv"
+    pd.DataFrame({"AGE": ["15-24"]}).to_csv(source, index=False)
+    assert source_year(source) == 2023
+    unnamed = tmp_path / "clean.csv"
+    source.rename(unnamed)
+    with pytest.raises(ValueError):
+        source_year(unnamed)
+
+
+def test_source_year_rejects_several_years(tmp_path):
+    source = tmp_path / "MHCLD_PUF_2023.csv"
+    pd.DataFrame({"YEAR": [2023, 2024], "AGE": [1, 2]}).to_csv(source, index=False)
+    with pytest.raises(ValueError):
+        source_year(source)
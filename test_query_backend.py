@@ -0,0 +1,116 @@
+"""
+Checks that DuckDBBackend over record-level Parquet answers like
+PandasBackend over the aggregates precompute_stats.py builds from the same
+records. Run with `python -m pytest test_query_backend.py`.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from clean_data import LABEL_MAPS, RAW_COLUMNS, iter_clean_chunks, write_parquet, write_partitioned
+from data_cube import DataCube
+from filter_index import FILTER_DIMENSIONS, FilterIndex
+from precompute_stats import DIAGNOSIS_COLS, aggregate_chunks, write_frame
+from query_backend import MISSING_FILLED, MISSING_LABEL, DuckDBBackend, PandasBackend
+
+pytest.importorskip("duckdb")
+
+# The dashboard's demographic cube axes (codes.py CUBE_AXES).
+CUBE_AXES = {
+    "AGE": ["AGE"],
+    "RACE": ["RACE"],
+    "SEX": ["SEX"],
+    "EMPLOY": ["EMPLOY"],
+    "LIVARAG": ["LIVARAG"],
+    "STATE": ["STATEFIP", "STATEFIP_code"],
+}
+SUBSTANCE_CUBES = {"YES": "substance_diagnosis_stats", "NO": "sap_diagnosis_stats"}
+MEASURES = ["DEPRESSFLG", "ANXIETYFLG", "SPHSERVICE", "CLIENT_COUNT"]
+
+
+def raw_puf(rows: int, seed: int = 4) -> pd.DataFrame:
+    """Raw PUF codes, -9 (missing) included, for a handful of states."""
+    rng = np.random.default_rng(seed)
+    raw = {}
+    for col in RAW_COLUMNS:
+        if col == "STATEFIP":
+            codes = [1, 2, 6, 10, 56, -9]
+        elif col in LABEL_MAPS:
+            codes = list(LABEL_MAPS[col]) + [-9]
+        else:
+            codes = [0, 1, 2, -9] if col.endswith("SERVICE") or col == "SAP" else [0, 1, -9]
+        raw[col] = rng.choice(codes, rows)
+    return pd.DataFrame(raw)
+
+
+def read_back(output_dir, name: str, dtype: dict) -> pd.DataFrame:
+    """An aggregate as codes.py reads it, with missing filter labels filled."""
+    frame = pd.read_csv(output_dir / f"{name}.csv", dtype=dtype)
+    for col in MISSING_FILLED:
+        if col in frame.columns:
+            frame[col] = frame[col].fillna(MISSING_LABEL)
+    return frame
+
+
+@pytest.fixture(scope="module")
+def backends(tmp_path_factory):
+    root = tmp_path_factory.mktemp("backends")
+    source = root / "MHCLD_PUF_2023.csv"
+    raw_puf(4000).to_csv(source, index=False)
+    write_parquet(iter_clean_chunks(source, 1000), root / "records.parquet")
+    write_partitioned(iter_clean_chunks(source, 1000), root / "records")
+
+    for name, frame in aggregate_chunks(source, 1000, raw=True).items():
+        write_frame(frame, root, name, "csv")
+    demographic = read_back(root, "demographic_service_stats", {"STATEFIP_code": str})
+    substance = read_back(root, "substance_stats", {"SAP": str})
+    measures = [col for col in demographic.columns if col.endswith(("FLG", "SERVICE")) or col == "CLIENT_COUNT"]
+    cubes = {}
+    for dia, name in SUBSTANCE_CUBES.items():
+        frame = read_back(root, name, {"SAP": str})
+        axes = {col: [col] for col in frame.columns if col not in DIAGNOSIS_COLS + ["CLIENT_COUNT"]}
+        cubes[dia] = DataCube.from_frame(frame, axes, DIAGNOSIS_COLS + ["CLIENT_COUNT"])
+    pandas_backend = PandasBackend(
+        DataCube.from_frame(demographic, CUBE_AXES, measures),
+        substance,
+        FilterIndex(substance, FILTER_DIMENSIONS),
+        cubes,
+    )
+    return pandas_backend, DuckDBBackend(root / "records.parquet"), DuckDBBackend(root / "records")
+
+
+def comparable(frame: pd.DataFrame) -> pd.DataFrame:
+    """Rows with clients (the cube also lists empty cells), as sorted plain values."""
+    if "CLIENT_COUNT" in frame.columns:
+        frame = frame[frame["CLIENT_COUNT"] > 0]
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.sort_values(list(frame.columns), key=lambda col: col.astype(str)).reset_index(drop=True)
+
+
+SELECTIONS = [
+    {},
+    {"SEX": ["Female", MISSING_LABEL]},
+    {"AGE": ["15-24", "25-34"], "RACE": ["White"], "LIVARAG": [MISSING_LABEL, "Private residence"]},
+]
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+def test_demographic_counts_match(backends, selection):
+    pandas_backend, *duckdb_backends = backends
+    groupings = [[], ["STATEFIP", "STATEFIP_code"], ["SEX"], ["AGE", "EMPLOY"]]
+    expected = pandas_backend.demographic_counts(selection, groupings, MEASURES)
+    for backend in duckdb_backends:
+        for result, reference in zip(backend.demographic_counts(selection, groupings, MEASURES), expected):
+            pd.testing.assert_frame_equal(comparable(result), comparable(reference), check_dtype=False)
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+@pytest.mark.parametrize("dia, by", [("YES", ["SUB"]), ("NO", ["SAP"])])
+def test_substance_counts_match(backends, selection, dia, by):
+    pandas_backend, *duckdb_backends = backends
+    measures = DIAGNOSIS_COLS + ["CLIENT_COUNT"]
+    expected = pandas_backend.substance_counts(selection, dia, by, measures)
+    for backend in duckdb_backends:
+        result = backend.substance_counts(selection, dia, by, measures)
+        pd.testing.assert_frame_equal(comparable(result), comparable(expected), check_dtype=False)
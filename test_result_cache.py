@@ -0,0 +1,39 @@
+"""
+Checks of the LRU result cache's eviction order and bookkeeping. Run with
+`python -m pytest test_result_cache.py`.
+"""
+
+import pytest
+
+from result_cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted_at_capacity():
+    cache = LRUCache(maxsize=2)
+    calls = []
+
+    def compute(key):
+        calls.append(key)
+        return key * 10
+
+    assert cache.get_or_compute(1, lambda: compute(1)) == 10
+    assert cache.get_or_compute(2, lambda: compute(2)) == 20
+    # Reading 1 makes 2 the least recently used, so adding 3 evicts 2.
+    assert cache.get_or_compute(1, lambda: compute(1)) == 10
+    assert cache.get_or_compute(3, lambda: compute(3)) == 30
+    assert cache.get_or_compute(1, lambda: compute(1)) == 10
+    assert cache.get_or_compute(2, lambda: compute(2)) == 20
+    assert calls == [1, 2, 3, 2]
+    assert cache.stats() == {"hits": 2, "misses": 4, "size": 2, "maxsize": 2}
+
+
+def test_exceptions_are_not_cached():
+    cache = LRUCache(maxsize=2)
+
+    def fail():
+        raise ValueError("no data")
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute("key", fail)
+    assert cache.get_or_compute("key", lambda: "value") == "value"
+    assert cache.stats()["size"] == 1
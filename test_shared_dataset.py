@@ -0,0 +1,30 @@
+"""
+Checks that SharedDataset frames cannot be mutated through the frames it
+hands out. Run with `python -m pytest test_shared_dataset.py`.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import shared_dataset
+from shared_dataset import SharedDataset
+
+
+@pytest.mark.parametrize("copy_on_write", [True, False])
+def test_writes_to_a_frame_leave_the_shared_data_unchanged(monkeypatch, copy_on_write):
+    monkeypatch.setattr(shared_dataset, "copy_on_write", lambda: copy_on_write)
+    shared = SharedDataset({"counts": pd.DataFrame({"SEX": ["Female", "Male"], "CLIENT_COUNT": [3, 4]})})
+    frame = shared.frame("counts")
+    frame.loc[0, "CLIENT_COUNT"] = 100
+    frame["SEX"] = frame["SEX"].str.upper()
+    assert shared.frame("counts")["CLIENT_COUNT"].tolist() == [3, 4]
+    assert shared.frame("counts")["SEX"].tolist() == ["Female", "Male"]
+
+
+def test_frames_share_their_buffers_under_copy_on_write():
+    if not shared_dataset.copy_on_write():
+        pytest.skip("pandas without Copy-on-Write")
+    shared = SharedDataset({"counts": pd.DataFrame({"CLIENT_COUNT": np.arange(5)})})
+    first, second = shared.frame("counts"), shared.frame("counts")
+    assert np.shares_memory(first["CLIENT_COUNT"].to_numpy(), second["CLIENT_COUNT"].to_numpy())
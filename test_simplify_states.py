@@ -0,0 +1,52 @@
+"""
+Checks of the bundled state outlines (static/us_states.topo.json) and of
+the ring pruning in simplify_states.py. Run with
+`python -m pytest test_simplify_states.py`.
+"""
+
+import json
+import math
+
+import numpy as np
+
+from simplify_states import DEFAULT_OUTPUT, decode_arc, prune_polygons, ring_coords
+
+
+def polygon_area(rings: list) -> float:
+    """
+    Spherical area (steradians) d3-geo gives a polygon of (lon, lat) rings,
+    following its areaRingSum: a ring is read as enclosing the region on its
+    right, so a wrongly wound ring covers nearly the whole sphere.
+    """
+    total = 0.0
+    for ring in rings:
+        lam = np.radians(ring[:, 0])
+        phi = np.radians(ring[:, 1]) / 2 + math.pi / 4
+        d_lam = np.diff(lam)
+        sign = np.sign(d_lam)
+        k = np.sin(phi[:-1]) * np.sin(phi[1:])
+        u = np.cos(phi[:-1]) * np.cos(phi[1:]) + k * np.cos(sign * d_lam)
+        v = k * sign * np.sin(sign * d_lam)
+        total += float(np.arctan2(v, u).sum())
+    return 2 * (total + 2 * math.pi if total < 0 else total)
+
+
+def test_bundled_states_cover_less_than_a_hemisphere():
+    topology = json.loads(DEFAULT_OUTPUT.read_text())
+    scale = np.asarray(topology["transform"]["scale"])
+    translate = np.asarray(topology["transform"]["translate"])
+    arcs = dict(enumerate(decode_arc(arc) for arc in topology["arcs"]))
+    for geometry in topology["objects"]["states"]["geometries"]:
+        polygons = geometry["arcs"] if geometry["type"] == "MultiPolygon" else [geometry["arcs"]]
+        for polygon in polygons:
+            rings = [ring_coords(ring, arcs, scale) + translate for ring in polygon]
+            assert polygon_area(rings) < 2 * math.pi, geometry["id"]
+
+
+def test_prune_polygons_drops_rings_whose_winding_flipped():
+    scale = np.ones(2)
+    clockwise = np.array([[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]])
+    source = {0: clockwise, 1: clockwise + 20}
+    simplified = {0: clockwise, 1: clockwise[::-1] + 20}
+    polygons = [[[0]], [[1]]]
+    assert prune_polygons(polygons, simplified, source, scale, min_area=1) == [[[0]]]